@@ -0,0 +1,37 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+
+from app.database import db
+from app.db import to_epoch
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL = int(os.getenv("ARCHIVE_INTERVAL", "86400"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+
+
+async def archive_closed_claims() -> int:
+    older_than_ts = to_epoch(dt.datetime.utcnow()) - ARCHIVE_AFTER_DAYS * 86400
+    total = 0
+    while True:
+        moved = await db.archive_closed_claims(older_than_ts, batch_size=ARCHIVE_BATCH_SIZE)
+        if not moved:
+            break
+        total += moved
+        # Let queued user writes in between batches
+        await asyncio.sleep(0.5)
+    if total:
+        logging.info(f"Archived {total} claims closed more than {ARCHIVE_AFTER_DAYS} days ago")
+    return total
+
+
+async def claims_archive_scheduler():
+    logging.info(f"Starting claims archive scheduler (closed > {ARCHIVE_AFTER_DAYS} days, every {ARCHIVE_INTERVAL}s)")
+    while True:
+        try:
+            await archive_closed_claims()
+        except Exception as e:
+            logging.error(f"Unexpected error in claims_archive_scheduler: {e}")
+
+        await asyncio.sleep(ARCHIVE_INTERVAL)
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import os
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+from app.database import db
+from app.ratelimit import limiter
+from app.records import BroadcastRecord
+from app.utils import fan_out
+
+# Messages per second, leaves part of the global limit to interactive replies
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", "100"))
+# How often a broadcast started or resumed by another process is picked up
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "10"))
+
+STATUS_LABELS = {
+    "draft": "ожидает запуска",
+    "running": "идет",
+    "paused": "на паузе",
+    "done": "завершена",
+    "cancelled": "отменена",
+}
+
+# Set by admin handlers of this process when a broadcast is started or resumed
+_wakeup = asyncio.Event()
+
+
+def wake_broadcasts() -> None:
+    _wakeup.set()
+
+
+def format_broadcast_stats(broadcast: BroadcastRecord, stats: dict[str, int]) -> str:
+    return (
+        f"Рассылка #{broadcast.id}: {STATUS_LABELS.get(broadcast.status, broadcast.status)}\n"
+        f"доставлено {stats.get('sent', 0)}, заблокировали бота {stats.get('blocked', 0)}, "
+        f"ошибок {stats.get('failed', 0)}, без подтверждения {stats.get('pending', 0)}"
+    )
+
+
+async def send_batch(bot: Bot, broadcast: BroadcastRecord, tg_ids: list[int]) -> None:
+    async def send(tg_id: int) -> None:
+        await limiter.throttle("broadcast", BROADCAST_RATE)
+        await bot.copy_message(tg_id, broadcast.from_chat_id, broadcast.message_id)
+
+    outcome = await fan_out(tg_ids, send, label=f"Broadcast #{broadcast.id}")
+    results = []
+    for tg_id, result in outcome.items():
+        if isinstance(result, TelegramForbiddenError):
+            results.append((tg_id, "blocked", None))
+        elif isinstance(result, Exception):
+            results.append((tg_id, "failed", str(result)[:500]))
+        else:
+            results.append((tg_id, "sent", None))
+    await db.save_broadcast_results(broadcast.id, results)
+
+
+async def run_broadcast(bot: Bot, broadcast_id: int) -> None:
+    """Send a running broadcast from its cursor until it is done or paused."""
+    while True:
+        # Re-read every batch: an admin may have paused it meanwhile
+        broadcast = await db.get_broadcast(broadcast_id)
+        if not broadcast or broadcast.status != "running":
+            return
+        tg_ids = await db.list_broadcast_recipients(broadcast.cursor, limit=BROADCAST_BATCH_SIZE)
+        if not tg_ids:
+            break
+        await db.take_broadcast_batch(broadcast.id, tg_ids)
+        await send_batch(bot, broadcast, tg_ids)
+
+    if not await db.set_broadcast_status(broadcast_id, "done", ("running",)):
+        return
+    stats = await db.get_broadcast_stats(broadcast_id)
+    logging.info(f"Broadcast #{broadcast_id} finished: {stats}")
+    if broadcast.created_by:
+        try:
+            await bot.send_message(broadcast.created_by, "✅ " + format_broadcast_stats(await db.get_broadcast(broadcast_id), stats))
+        except Exception as e:
+            logging.error(f"Failed to report broadcast #{broadcast_id} to {broadcast.created_by}: {e}")
+
+
+async def broadcast_scheduler(bot: Bot):
+    logging.info(f"Starting broadcast worker ({BROADCAST_RATE} msg/s)")
+    while True:
+        _wakeup.clear()
+        try:
+            # One broadcast at a time, in the order they were started
+            for broadcast in await db.list_broadcasts(status="running", limit=1):
+                await run_broadcast(bot, broadcast.id)
+                _wakeup.set()
+        except Exception as e:
+            logging.error(f"Unexpected error in broadcast_scheduler: {e}")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), BROADCAST_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,82 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+# Returned by LRUCache.get on a miss, so that None can be cached as a value
+MISSING = object()
+
+
+class LRUCache:
+    """Bounded LRU cache with per-entry TTL and hit/miss counters."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # Clock value of the last invalidation of recently invalidated keys;
+        # see set(..., version=...). Only the newest maxsize are kept, older
+        # ones are summed up by _floor.
+        self._clock = 0
+        self._invalidated: OrderedDict[Hashable, int] = OrderedDict()
+        self._floor = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return MISSING
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def version(self, key: Hashable) -> int:
+        """Taken before loading a value; set() drops it if key was invalidated meanwhile."""
+        return self._clock
+
+    def set(self, key: Hashable, value: Any, version: int | None = None) -> None:
+        # A value loaded before an invalidation of its key may already be stale
+        if version is not None and (version < self._floor or self._invalidated.get(key, -1) > version):
+            return
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> None:
+        self._clock += 1
+        self._data.pop(key, None)
+        self._invalidated[key] = self._clock
+        self._invalidated.move_to_end(key)
+        if len(self._invalidated) > max(self.maxsize, 1):
+            _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self) -> None:
+        self._clock += 1
+        self._floor = self._clock
+        self._invalidated.clear()
+        self._data.clear()
+
+    def stats(self) -> dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
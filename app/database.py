@@ -2,5 +2,15 @@ import os
 from app.db import Database
 
 DB_PATH = os.getenv("DB_PATH", "data/data.db")
-db = Database(DB_PATH)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "100000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+CLAIM_CACHE_SIZE = int(os.getenv("CLAIM_CACHE_SIZE", "100000"))
+CLAIM_CACHE_TTL = float(os.getenv("CLAIM_CACHE_TTL", "300"))
+db = Database(
+    DB_PATH,
+    user_cache_size=USER_CACHE_SIZE,
+    user_cache_ttl=USER_CACHE_TTL,
+    claim_cache_size=CLAIM_CACHE_SIZE,
+    claim_cache_ttl=CLAIM_CACHE_TTL,
+)
 
@@ -1,15 +1,298 @@
+import asyncio
+import calendar
+import contextlib
 import datetime as dt
-from typing import Any
+import json
+import logging
+import re
+import sqlite3
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable
 
 import aiosqlite
 
+from app.cache import LRUCache, MISSING
+from app.records import BroadcastRecord, ClaimFileRecord, ClaimRecord, OutboxRecord, UserRecord, WarrantyRecord
+from app.instrumentation import DB_METRICS, DB_SLOW_QUERY_MS, current_statements, instrument, log_slow_call, redact_sql
 
+WriteOp = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+# "01" + GTIN (14 digits) + "21" is shared by every item of a product and the
+# serial number after it is 13 characters long: only a prefix that contains the
+# whole serial points at a single item
+CZ_MIN_PREFIX = 31
+
+_CZ_NOISE_RE = re.compile(r"[\s()\x1d\x1e\x04]")
+# Statements from a slow-call trace that EXPLAIN QUERY PLAN is run for
+_EXPLAINABLE_RE = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|WITH|REPLACE)\b", re.IGNORECASE)
+
+
+def normalize_cz_code(code: str) -> str:
+    """Canonical key of a Честный знак code: no symbology prefix, separators or spaces."""
+    code = code.strip()
+    if code.startswith(("]d2", "]C1", "]Q3")):
+        code = code[3:]
+    return _CZ_NOISE_RE.sub("", code)
+
+
+# Integer epoch (UTC seconds) columns that mirror the ISO text timestamps
+TS_COLUMNS = [
+    ("users", "created_at", "created_ts"),
+    ("claims", "created_at", "created_ts"),
+    ("claims", "updated_at", "updated_ts"),
+    ("claim_notes", "created_at", "created_ts"),
+    ("warranties", "start_date", "start_ts"),
+    ("warranties", "end_date", "end_ts"),
+    ("warranties", "created_at", "created_ts"),
+]
+
+
+# Stored in PRAGMA user_version. Migrations that can't be written as IF NOT
+# EXISTS statements (e.g. a changed trigger body) run once when it is bumped.
+SCHEMA_VERSION = 1
+
+# Claims in these statuses are moved to the archive tables once they have been closed for a while
+CLOSED_CLAIM_STATUSES = ("Решено", "Закрыта")
+
+CLAIM_COLUMNS = (
+    "id, tg_id, description, purchase_type, purchase_value, status, manager_comment, "
+    "group_message_id, created_at, updated_at, created_ts, updated_ts"
+)
+CLAIM_FILE_COLUMNS = "id, claim_id, file_id, file_type"
+USER_COLUMNS = "tg_id, username, name, phone, email, thread_id, created_at, created_ts"
+WARRANTY_COLUMNS = (
+    "id, tg_id, cz_code, cz_file_id, receipt_file_id, sku, receipt_date, receipt_text, receipt_items, "
+    "start_date, end_date, created_at, synced, cz_key, reminder_sent_ts, start_ts, end_ts, created_ts"
+)
+CLAIM_NOTE_COLUMNS = "id, claim_id, author, text, created_at, created_ts"
+OUTBOX_COLUMNS = "id, kind, key, payload, status, attempts, next_attempt_ts, done, last_error, created_ts"
+BROADCAST_COLUMNS = "id, from_chat_id, message_id, status, cursor, created_by, created_ts, finished_ts"
+
+# Outbox kind of the admin notification about a new claim
+NEW_CLAIM_EVENT = "new_claim"
+
+
+def _qualified(columns: str, alias: str) -> str:
+    return ", ".join(f"{alias}.{column.strip()}" for column in columns.split(","))
+
+
+def to_epoch(value: dt.date) -> int:
+    """UTC epoch seconds for a naive UTC datetime or a date (midnight)."""
+    return calendar.timegm(value.timetuple())
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    # Smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class WriteQueue:
+    """Single writer with group commit.
+
+    All writes are queued and executed by one task on one connection. Writes
+    that arrive within ``flush_interval`` are committed in a single
+    transaction, each wrapped in a savepoint so that a failing write does not
+    roll back its neighbours.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 0.005, max_batch: int = 500) -> None:
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.last_write_at = time.monotonic()
+        self._queue: asyncio.Queue[tuple[WriteOp, asyncio.Future, list[str] | None] | None] = asyncio.Queue()
+        self._conn: aiosqlite.Connection | None = None
+        self._task: asyncio.Task | None = None
+        # Where the trace callback records SQL of the op being executed
+        self._statements: list[str] | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._conn = await aiosqlite.connect(self.path, isolation_level=None)
+        await self._conn.execute("PRAGMA busy_timeout=5000")
+        await self._conn.execute("PRAGMA synchronous=NORMAL")
+        if DB_METRICS and DB_SLOW_QUERY_MS > 0:
+            await self._conn.set_trace_callback(self._trace)
+        self._task = asyncio.create_task(self._run())
+
+    def _trace(self, sql: str) -> None:
+        if self._statements is not None:
+            self._statements.append(sql)
+
+    async def stop(self) -> None:
+        if self._task:
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        if self._conn:
+            await self._conn.close()
+            self._conn = None
+
+    async def submit(self, op: WriteOp) -> Any:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((op, future, current_statements.get()))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            # Give concurrent writers a moment to join this transaction
+            await asyncio.sleep(self.flush_interval)
+            stop = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+            if stop:
+                return
+
+    async def _flush(self, batch: list[tuple[WriteOp, asyncio.Future, list[str] | None]]) -> None:
+        conn = self._conn
+        results: list[tuple[asyncio.Future, Any, BaseException | None]] = []
+        try:
+            await conn.execute("BEGIN IMMEDIATE")
+            for op, future, statements in batch:
+                await conn.execute("SAVEPOINT write_op")
+                self._statements = statements
+                try:
+                    result = await op(conn)
+                except Exception as e:
+                    await conn.execute("ROLLBACK TO write_op")
+                    await conn.execute("RELEASE write_op")
+                    results.append((future, None, e))
+                else:
+                    await conn.execute("RELEASE write_op")
+                    results.append((future, result, None))
+                finally:
+                    self._statements = None
+            await conn.execute("COMMIT")
+        except Exception as e:
+            logging.error(f"Write batch of {len(batch)} failed: {e}")
+            try:
+                await conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            results = [(future, None, e) for _, future, _ in batch]
+
+        self.last_write_at = time.monotonic()
+        for future, result, error in results:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+@instrument
 class Database:
-    def __init__(self, path: str) -> None:
+    # How often cached settings are checked against the change counter in the DB
+    SETTINGS_REFRESH_INTERVAL = 5.0
+
+    # How often claim and user changes made by other processes are picked up
+    CLAIM_CHANGES_POLL_INTERVAL = 1.0
+    USER_CHANGES_POLL_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        path: str,
+        user_cache_size: int = 100_000,
+        user_cache_ttl: float = 300.0,
+        claim_cache_size: int = 100_000,
+        claim_cache_ttl: float = 300.0,
+    ) -> None:
         self.path = path
+        self.writer = WriteQueue(path)
+        self.user_cache = LRUCache(user_cache_size, user_cache_ttl)
+        # Last claim of each user, read by the message relay on every private message
+        self.claim_cache = LRUCache(claim_cache_size, claim_cache_ttl)
+        self._claim_changes_seq = 0
+        self._claim_changes_checked_at = 0.0
+        self._user_changes_seq = 0
+        self._user_changes_checked_at = 0.0
+        self._settings: dict[str, str] = {}
+        self._settings_version = -1
+        self._settings_checked_at = 0.0
+        self._background: set[asyncio.Task] = set()
+        # Forum topic of each user and back, loaded at startup; misses fall back to the DB
+        self._user_threads: dict[int, int] = {}
+        self._thread_users: dict[int, int] = {}
+        self._stats_rebuild_lock = asyncio.Lock()
 
-    async def init(self) -> None:
+    @contextlib.asynccontextmanager
+    async def _connect(self) -> AsyncIterator[aiosqlite.Connection]:
         async with aiosqlite.connect(self.path) as db:
+            statements = current_statements.get()
+            if statements is not None:
+                await db.set_trace_callback(statements.append)
+            yield db
+
+    def _log_slow_call(self, name: str, elapsed: float, statements: list[str]) -> None:
+        task = asyncio.create_task(self._explain_slow_call(name, elapsed, statements))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _explain_slow_call(self, name: str, elapsed: float, statements: list[str]) -> None:
+        plans: list[tuple[str, list[str]]] = []
+        seen: set[str] = set()
+        try:
+            async with aiosqlite.connect(self.path) as db:
+                for sql in statements:
+                    # Only the redacted text is planned and logged; the parameters are unknown
+                    # by now, NULLs are bound in their place
+                    sql = redact_sql(sql)
+                    if sql in seen or not _EXPLAINABLE_RE.match(sql):
+                        continue
+                    seen.add(sql)
+                    try:
+                        cur = await db.execute(f"EXPLAIN QUERY PLAN {sql}", [None] * sql.count("?"))
+                        plan = [row[3] for row in await cur.fetchall()]
+                    except Exception as e:
+                        plan = [f"(no plan: {e})"]
+                    plans.append((sql, plan))
+                    if len(plans) >= 10:
+                        break
+        except Exception as e:
+            logging.error(f"Failed to explain slow call {name}: {e}")
+        log_slow_call(name, elapsed, plans)
+
+    async def _write(self, op: WriteOp) -> Any:
+        if self.writer.running:
+            return await self.writer.submit(op)
+        # Writer is not started (scripts): run in a short-lived transaction
+        async with self._connect() as db:
+            result = await op(db)
+            await db.commit()
+            return result
+
+    async def close(self) -> None:
+        await self.writer.stop()
+
+    def cache_stats(self) -> dict[str, dict[str, Any]]:
+        return {"users": self.user_cache.stats(), "last_claims": self.claim_cache.stats()}
+
+    async def init(self) -> None:
+        async with self._connect() as db:
+            cur = await db.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            existing_tables = {row[0] for row in await cur.fetchall()}
+            cur = await db.execute("PRAGMA user_version")
+            schema_version = (await cur.fetchone())[0]
+            if not existing_tables:
+                # Only possible on an empty file; lets maintenance return free pages to the OS
+                await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            # WAL lets readers work while the writer holds the write lock
+            await db.execute("PRAGMA journal_mode=WAL")
             await db.executescript(
                 """
                 CREATE TABLE IF NOT EXISTS users (
@@ -27,6 +310,28 @@ class Database:
                     value TEXT
                 );
 
+                -- Bumped on every settings change so other processes can drop their cache
+                CREATE TABLE IF NOT EXISTS settings_version (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    version INTEGER NOT NULL
+                );
+                INSERT OR IGNORE INTO settings_version (id, version) VALUES (1, 0);
+
+                CREATE TRIGGER IF NOT EXISTS settings_version_insert AFTER INSERT ON settings
+                BEGIN
+                    UPDATE settings_version SET version = version + 1 WHERE id = 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS settings_version_update AFTER UPDATE ON settings
+                BEGIN
+                    UPDATE settings_version SET version = version + 1 WHERE id = 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS settings_version_delete AFTER DELETE ON settings
+                BEGIN
+                    UPDATE settings_version SET version = version + 1 WHERE id = 1;
+                END;
+
                 CREATE TABLE IF NOT EXISTS claims (
                     id TEXT PRIMARY KEY,
                     tg_id INTEGER,
@@ -105,70 +410,617 @@ class Database:
             except aiosqlite.OperationalError:
                 pass # already exists
 
+            try:
+                await db.execute("ALTER TABLE warranties ADD COLUMN cz_key TEXT")
+            except aiosqlite.OperationalError:
+                pass # already exists
+
+            try:
+                await db.execute("ALTER TABLE warranties ADD COLUMN reminder_sent_ts INTEGER")
+            except aiosqlite.OperationalError:
+                pass # already exists
+
+            for table, _, ts_column in TS_COLUMNS:
+                try:
+                    await db.execute(f"ALTER TABLE {table} ADD COLUMN {ts_column} INTEGER")
+                except aiosqlite.OperationalError:
+                    pass # already exists
+
+            await db.executescript(
+                """
+                CREATE INDEX IF NOT EXISTS idx_warranties_cz_key ON warranties (cz_key);
+                DROP INDEX IF EXISTS idx_claims_created;
+                DROP INDEX IF EXISTS idx_claims_status_created;
+                -- Timestamps are whole seconds: ties are broken by the claim number, not the TEXT id
+                DROP INDEX IF EXISTS idx_claims_created_ts;
+                DROP INDEX IF EXISTS idx_claims_status_created_ts;
+                DROP INDEX IF EXISTS idx_claims_user_updated_ts;
+                CREATE INDEX IF NOT EXISTS idx_claims_created_ts_number ON claims (created_ts, CAST(id AS INTEGER), id);
+                CREATE INDEX IF NOT EXISTS idx_claims_status_created_ts_number ON claims (status, created_ts, CAST(id AS INTEGER), id);
+                CREATE INDEX IF NOT EXISTS idx_claims_user_updated_ts_number ON claims (tg_id, updated_ts, CAST(id AS INTEGER));
+                CREATE INDEX IF NOT EXISTS idx_warranties_end_ts ON warranties (end_ts, id);
+                CREATE INDEX IF NOT EXISTS idx_warranties_reminder_due ON warranties (end_ts, id) WHERE reminder_sent_ts IS NULL;
+                CREATE INDEX IF NOT EXISTS idx_warranties_created_ts ON warranties (created_ts);
+                CREATE INDEX IF NOT EXISTS idx_warranties_unsynced ON warranties (id) WHERE synced = 0;
+                CREATE INDEX IF NOT EXISTS idx_warranties_tg_id ON warranties (tg_id);
+
+                -- Claims per status, kept up to date by triggers instead of COUNT(*)
+                CREATE TABLE IF NOT EXISTS claim_counters (
+                    status TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL DEFAULT 0
+                );
+
+                CREATE TRIGGER IF NOT EXISTS claim_counters_insert AFTER INSERT ON claims
+                BEGIN
+                    INSERT INTO claim_counters (status, count) VALUES (NEW.status, 1)
+                    ON CONFLICT(status) DO UPDATE SET count = count + 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_counters_update AFTER UPDATE OF status ON claims
+                WHEN OLD.status IS NOT NEW.status
+                BEGIN
+                    UPDATE claim_counters SET count = count - 1 WHERE status = OLD.status;
+                    INSERT INTO claim_counters (status, count) VALUES (NEW.status, 1)
+                    ON CONFLICT(status) DO UPDATE SET count = count + 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_counters_delete AFTER DELETE ON claims
+                BEGIN
+                    UPDATE claim_counters SET count = count - 1 WHERE status = OLD.status;
+                END;
+                """
+            )
+            if "claim_counters" not in existing_tables:
+                await db.execute(
+                    "INSERT INTO claim_counters (status, count) SELECT status, COUNT(*) FROM claims WHERE status IS NOT NULL GROUP BY status"
+                )
+
+            # How many of count are in claims_archive, so lists of hot claims can be counted too
+            try:
+                await db.execute("ALTER TABLE claim_counters ADD COLUMN archived INTEGER NOT NULL DEFAULT 0")
+                fill_archived = "claims_archive" in existing_tables
+            except aiosqlite.OperationalError:
+                fill_archived = False # already exists
+
+            await db.executescript(
+                """
+                -- Aggregates for /stats: (metric, bucket) -> value, maintained on writes
+                CREATE TABLE IF NOT EXISTS stats_counters (
+                    metric TEXT NOT NULL,
+                    bucket TEXT NOT NULL,
+                    value INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (metric, bucket)
+                );
+                CREATE INDEX IF NOT EXISTS idx_stats_counters_value ON stats_counters (metric, value);
+
+                CREATE TRIGGER IF NOT EXISTS stats_warranties_insert AFTER INSERT ON warranties
+                BEGIN
+                    INSERT INTO stats_counters (metric, bucket, value) VALUES ('warranties', 'total', 1)
+                    ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+                    INSERT INTO stats_counters (metric, bucket, value)
+                    VALUES ('warranties_by_day', COALESCE(substr(NEW.created_at, 1, 10), ''), 1)
+                    ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+                    INSERT INTO stats_counters (metric, bucket, value)
+                    VALUES ('warranties_by_sku', COALESCE(NEW.sku, ''), 1)
+                    ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS stats_warranties_update AFTER UPDATE OF sku ON warranties
+                WHEN OLD.sku IS NOT NEW.sku
+                BEGIN
+                    UPDATE stats_counters SET value = value - 1
+                    WHERE metric = 'warranties_by_sku' AND bucket = COALESCE(OLD.sku, '');
+                    INSERT INTO stats_counters (metric, bucket, value)
+                    VALUES ('warranties_by_sku', COALESCE(NEW.sku, ''), 1)
+                    ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS stats_warranties_delete AFTER DELETE ON warranties
+                BEGIN
+                    UPDATE stats_counters SET value = value - 1 WHERE metric = 'warranties' AND bucket = 'total';
+                    UPDATE stats_counters SET value = value - 1
+                    WHERE metric = 'warranties_by_day' AND bucket = COALESCE(substr(OLD.created_at, 1, 10), '');
+                    UPDATE stats_counters SET value = value - 1
+                    WHERE metric = 'warranties_by_sku' AND bucket = COALESCE(OLD.sku, '');
+                END;
+                """
+            )
+
+            await db.executescript(
+                """
+                -- Full-text search for admins. External content tables: the text lives in
+                -- the source tables, the triggers keep the indexes in sync.
+                CREATE VIRTUAL TABLE IF NOT EXISTS claims_fts
+                USING fts5(description, content='claims', content_rowid='rowid');
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS claim_notes_fts
+                USING fts5(text, content='claim_notes', content_rowid='id');
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS warranties_fts
+                USING fts5(sku, receipt_items, content='warranties', content_rowid='rowid');
+
+                CREATE TRIGGER IF NOT EXISTS claims_fts_insert AFTER INSERT ON claims
+                BEGIN
+                    INSERT INTO claims_fts (rowid, description) VALUES (NEW.rowid, NEW.description);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claims_fts_update AFTER UPDATE OF description ON claims
+                BEGIN
+                    INSERT INTO claims_fts (claims_fts, rowid, description) VALUES ('delete', OLD.rowid, OLD.description);
+                    INSERT INTO claims_fts (rowid, description) VALUES (NEW.rowid, NEW.description);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claims_fts_delete AFTER DELETE ON claims
+                BEGIN
+                    INSERT INTO claims_fts (claims_fts, rowid, description) VALUES ('delete', OLD.rowid, OLD.description);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_notes_fts_insert AFTER INSERT ON claim_notes
+                BEGIN
+                    INSERT INTO claim_notes_fts (rowid, text) VALUES (NEW.id, NEW.text);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_notes_fts_update AFTER UPDATE OF text ON claim_notes
+                BEGIN
+                    INSERT INTO claim_notes_fts (claim_notes_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+                    INSERT INTO claim_notes_fts (rowid, text) VALUES (NEW.id, NEW.text);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_notes_fts_delete AFTER DELETE ON claim_notes
+                BEGIN
+                    INSERT INTO claim_notes_fts (claim_notes_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS warranties_fts_insert AFTER INSERT ON warranties
+                BEGIN
+                    INSERT INTO warranties_fts (rowid, sku, receipt_items) VALUES (NEW.rowid, NEW.sku, NEW.receipt_items);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS warranties_fts_update AFTER UPDATE OF sku, receipt_items ON warranties
+                BEGIN
+                    INSERT INTO warranties_fts (warranties_fts, rowid, sku, receipt_items)
+                    VALUES ('delete', OLD.rowid, OLD.sku, OLD.receipt_items);
+                    INSERT INTO warranties_fts (rowid, sku, receipt_items) VALUES (NEW.rowid, NEW.sku, NEW.receipt_items);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS warranties_fts_delete AFTER DELETE ON warranties
+                BEGIN
+                    INSERT INTO warranties_fts (warranties_fts, rowid, sku, receipt_items)
+                    VALUES ('delete', OLD.rowid, OLD.sku, OLD.receipt_items);
+                END;
+                """
+            )
             await db.commit()
 
+            # Fill epoch columns for rows created before they existed
+            for table, text_column, ts_column in TS_COLUMNS:
+                while True:
+                    cur = await db.execute(
+                        f"""
+                        UPDATE {table} SET {ts_column} = CAST(strftime('%s', {text_column}) AS INTEGER)
+                        WHERE rowid IN (
+                            SELECT rowid FROM {table}
+                            WHERE {ts_column} IS NULL AND strftime('%s', {text_column}) IS NOT NULL
+                            LIMIT 5000
+                        )
+                        """
+                    )
+                    await db.commit()
+                    if cur.rowcount == 0:
+                        break
+
+            # Fill cz_key for rows created before the column existed
+            while True:
+                cur = await db.execute(
+                    "SELECT rowid, cz_code FROM warranties WHERE cz_key IS NULL AND cz_code IS NOT NULL LIMIT 5000"
+                )
+                rows = await cur.fetchall()
+                if not rows:
+                    break
+                await db.executemany(
+                    "UPDATE warranties SET cz_key=? WHERE rowid=?",
+                    [(normalize_cz_code(cz_code), rowid) for rowid, cz_code in rows],
+                )
+                await db.commit()
+
+            if schema_version < 1:
+                # The archive counter triggers also maintain claim_counters.archived now
+                await db.execute("DROP TRIGGER IF EXISTS claim_counters_archive_insert")
+                await db.execute("DROP TRIGGER IF EXISTS claim_counters_archive_delete")
+                await db.commit()
+
+            await db.executescript(
+                """
+                CREATE INDEX IF NOT EXISTS idx_claim_files_claim ON claim_files (claim_id);
+                CREATE INDEX IF NOT EXISTS idx_claim_notes_claim ON claim_notes (claim_id);
+                CREATE INDEX IF NOT EXISTS idx_claims_status_updated_ts ON claims (status, updated_ts);
+
+                -- Closed claims are moved here so the hot tables stay small
+                CREATE TABLE IF NOT EXISTS claims_archive (
+                    id TEXT PRIMARY KEY,
+                    tg_id INTEGER,
+                    description TEXT,
+                    purchase_type TEXT,
+                    purchase_value TEXT,
+                    status TEXT,
+                    manager_comment TEXT,
+                    group_message_id INTEGER,
+                    created_at TEXT,
+                    updated_at TEXT,
+                    created_ts INTEGER,
+                    updated_ts INTEGER,
+                    archived_ts INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_claims_archive_user ON claims_archive (tg_id, updated_ts);
+
+                CREATE TABLE IF NOT EXISTS claim_files_archive (
+                    id INTEGER PRIMARY KEY,
+                    claim_id TEXT,
+                    file_id TEXT,
+                    file_type TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_claim_files_archive_claim ON claim_files_archive (claim_id);
+
+                CREATE TABLE IF NOT EXISTS claim_notes_archive (
+                    id INTEGER PRIMARY KEY,
+                    claim_id TEXT,
+                    author TEXT,
+                    text TEXT,
+                    created_at TEXT,
+                    created_ts INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_claim_notes_archive_claim ON claim_notes_archive (claim_id);
+
+                -- Archived text stays searchable; archive rows are only inserted and deleted
+                CREATE VIRTUAL TABLE IF NOT EXISTS claims_archive_fts
+                USING fts5(description, content='claims_archive', content_rowid='rowid');
+
+                CREATE VIRTUAL TABLE IF NOT EXISTS claim_notes_archive_fts
+                USING fts5(text, content='claim_notes_archive', content_rowid='id');
+
+                CREATE TRIGGER IF NOT EXISTS claims_archive_fts_insert AFTER INSERT ON claims_archive
+                BEGIN
+                    INSERT INTO claims_archive_fts (rowid, description) VALUES (NEW.rowid, NEW.description);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claims_archive_fts_delete AFTER DELETE ON claims_archive
+                BEGIN
+                    INSERT INTO claims_archive_fts (claims_archive_fts, rowid, description)
+                    VALUES ('delete', OLD.rowid, OLD.description);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_notes_archive_fts_insert AFTER INSERT ON claim_notes_archive
+                BEGIN
+                    INSERT INTO claim_notes_archive_fts (rowid, text) VALUES (NEW.id, NEW.text);
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_notes_archive_fts_delete AFTER DELETE ON claim_notes_archive
+                BEGIN
+                    INSERT INTO claim_notes_archive_fts (claim_notes_archive_fts, rowid, text) VALUES ('delete', OLD.id, OLD.text);
+                END;
+
+                -- Archived claims still count in claim_counters: moving a claim is -1 on
+                -- claims and +1 here. archived counts them separately.
+                CREATE TRIGGER IF NOT EXISTS claim_counters_archive_insert AFTER INSERT ON claims_archive
+                BEGIN
+                    INSERT INTO claim_counters (status, count, archived) VALUES (NEW.status, 1, 1)
+                    ON CONFLICT(status) DO UPDATE SET count = count + 1, archived = archived + 1;
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_counters_archive_delete AFTER DELETE ON claims_archive
+                BEGIN
+                    UPDATE claim_counters SET count = count - 1, archived = archived - 1 WHERE status = OLD.status;
+                END;
+
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT,
+                    updated_ts INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_ts ON fsm_states (updated_ts);
+
+                -- Notifications written together with the change they report, delivered by app/outbox.py
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL UNIQUE,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_ts INTEGER NOT NULL,
+                    done TEXT,
+                    last_error TEXT,
+                    created_ts INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_ts, id) WHERE status = 'pending';
+
+                -- Users whose claims changed; other processes drop their cached last claim from it
+                CREATE TABLE IF NOT EXISTS claim_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tg_id INTEGER NOT NULL,
+                    changed_ts INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_claim_changes_changed_ts ON claim_changes (changed_ts);
+
+                -- Users whose row changed; other processes drop their cached user and forum topic from it
+                CREATE TABLE IF NOT EXISTS user_changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    tg_id INTEGER NOT NULL,
+                    changed_ts INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_user_changes_changed_ts ON user_changes (changed_ts);
+
+                -- Mass messages to warranty holders: a copy of an admin's message, sent by app/broadcast.py.
+                -- status: draft, running, paused, done, cancelled; cursor is the last tg_id taken
+                CREATE TABLE IF NOT EXISTS broadcasts (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    from_chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'draft',
+                    cursor INTEGER NOT NULL DEFAULT 0,
+                    created_by INTEGER,
+                    created_ts INTEGER NOT NULL,
+                    finished_ts INTEGER
+                );
+
+                -- status: pending (taken, result unknown after a crash), sent, blocked, failed
+                CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+                    broadcast_id INTEGER NOT NULL,
+                    tg_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    error TEXT,
+                    updated_ts INTEGER NOT NULL,
+                    PRIMARY KEY (broadcast_id, tg_id)
+                ) WITHOUT ROWID;
+
+                CREATE TRIGGER IF NOT EXISTS claim_changes_insert AFTER INSERT ON claims
+                BEGIN
+                    INSERT INTO claim_changes (tg_id, changed_ts) VALUES (NEW.tg_id, CAST(strftime('%s', 'now') AS INTEGER));
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_changes_update AFTER UPDATE ON claims
+                BEGIN
+                    INSERT INTO claim_changes (tg_id, changed_ts) VALUES (NEW.tg_id, CAST(strftime('%s', 'now') AS INTEGER));
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS claim_changes_delete AFTER DELETE ON claims
+                BEGIN
+                    INSERT INTO claim_changes (tg_id, changed_ts) VALUES (OLD.tg_id, CAST(strftime('%s', 'now') AS INTEGER));
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS user_changes_insert AFTER INSERT ON users
+                BEGIN
+                    INSERT INTO user_changes (tg_id, changed_ts) VALUES (NEW.tg_id, CAST(strftime('%s', 'now') AS INTEGER));
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS user_changes_update AFTER UPDATE ON users
+                BEGIN
+                    INSERT INTO user_changes (tg_id, changed_ts) VALUES (NEW.tg_id, CAST(strftime('%s', 'now') AS INTEGER));
+                END;
+
+                CREATE TRIGGER IF NOT EXISTS user_changes_delete AFTER DELETE ON users
+                BEGIN
+                    INSERT INTO user_changes (tg_id, changed_ts) VALUES (OLD.tg_id, CAST(strftime('%s', 'now') AS INTEGER));
+                END;
+                """
+            )
+            if fill_archived:
+                await db.execute(
+                    "UPDATE claim_counters SET archived = (SELECT COUNT(*) FROM claims_archive a WHERE a.status = claim_counters.status)"
+                )
+                await db.commit()
+            if schema_version < SCHEMA_VERSION:
+                await db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                await db.commit()
+
+        if "claims_fts" not in existing_tables or "claims_archive_fts" not in existing_tables:
+            await self.rebuild_search_index()
+        if "stats_counters" not in existing_tables:
+            await self.rebuild_stats()
+        await self.open()
+
+    async def open(self) -> None:
+        """Load the in-memory state and start the writer, without touching the schema.
+
+        For processes next to the one that ran init() (shard workers): running
+        the migrations from several processes at once ends in "database is locked".
+        """
+        await self._refresh_settings()
+        await self._load_threads()
+        async with self._connect() as db:
+            cur = await db.execute("SELECT COALESCE(MAX(seq), 0) FROM claim_changes")
+            self._claim_changes_seq = (await cur.fetchone())[0]
+            cur = await db.execute("SELECT COALESCE(MAX(seq), 0) FROM user_changes")
+            self._user_changes_seq = (await cur.fetchone())[0]
+        await self.writer.start()
+
     async def upsert_user(self, tg_id: int, username: str | None, name: str | None) -> None:
-        now = dt.datetime.utcnow().isoformat()
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute(
+        now = dt.datetime.utcnow()
+        async def op(db: aiosqlite.Connection) -> bool:
+            # Called on almost every update: the row is only rewritten (and the
+            # cached user dropped) when something actually changed
+            cur = await db.execute(
                 """
-                INSERT INTO users (tg_id, username, name, created_at)
-                VALUES (?, ?, ?, ?)
+                INSERT INTO users (tg_id, username, name, created_at, created_ts)
+                VALUES (?, ?, ?, ?, ?)
                 ON CONFLICT(tg_id) DO UPDATE SET
                     username=excluded.username,
                     name=COALESCE(excluded.name, users.name)
+                WHERE users.username IS NOT excluded.username
+                   OR (excluded.name IS NOT NULL AND users.name IS NOT excluded.name)
+                RETURNING tg_id
                 """,
-                (tg_id, username, name, now),
+                (tg_id, username, name, now.isoformat(), to_epoch(now)),
             )
-            await db.commit()
+            return bool(await cur.fetchall())
+
+        if await self._write(op):
+            self.user_cache.pop(tg_id)
 
     async def update_user_phone(self, tg_id: int, phone: str | None) -> None:
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute("UPDATE users SET phone=? WHERE tg_id=?", (phone, tg_id))
-            await db.commit()
+
+        await self._write(op)
+        self.user_cache.pop(tg_id)
 
     async def update_user_email(self, tg_id: int, email: str | None) -> None:
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute("UPDATE users SET email=? WHERE tg_id=?", (email, tg_id))
-            await db.commit()
+
+        await self._write(op)
+        self.user_cache.pop(tg_id)
 
     async def update_user_thread(self, tg_id: int, thread_id: int | None) -> None:
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute("UPDATE users SET thread_id=? WHERE tg_id=?", (thread_id, tg_id))
-            await db.commit()
 
-    async def get_setting(self, key: str) -> str | None:
-        async with aiosqlite.connect(self.path) as db:
-            cur = await db.execute("SELECT value FROM settings WHERE key=?", (key,))
+        await self._write(op)
+        self.user_cache.pop(tg_id)
+        if thread_id is None:
+            self._forget_thread(tg_id)
+        else:
+            self._remember_thread(tg_id, thread_id)
+
+    async def claim_user_thread(self, tg_id: int, thread_id: int) -> int | None:
+        """Save thread_id as the user's topic unless another process already saved one.
+
+        Returns the topic the user ends up with: thread_id if it won, the
+        other one if it lost, None if the user doesn't exist.
+        """
+        async def op(db: aiosqlite.Connection) -> int | None:
+            cur = await db.execute(
+                "UPDATE users SET thread_id=? WHERE tg_id=? AND thread_id IS NULL RETURNING thread_id",
+                (thread_id, tg_id),
+            )
             row = await cur.fetchone()
+            await cur.fetchall()
+            if row is None:
+                cur = await db.execute("SELECT thread_id FROM users WHERE tg_id=?", (tg_id,))
+                row = await cur.fetchone()
             return row[0] if row else None
 
+        winner = await self._write(op)
+        self.user_cache.pop(tg_id)
+        if winner is not None:
+            self._remember_thread(tg_id, winner)
+        return winner
+
+    def _remember_thread(self, tg_id: int, thread_id: int) -> None:
+        self._forget_thread(tg_id)
+        self._user_threads[tg_id] = thread_id
+        self._thread_users[thread_id] = tg_id
+
+    def _forget_thread(self, tg_id: int) -> None:
+        thread_id = self._user_threads.pop(tg_id, None)
+        if thread_id is not None:
+            self._thread_users.pop(thread_id, None)
+
+    async def _load_threads(self) -> None:
+        async with self._connect() as db:
+            cur = await db.execute("SELECT tg_id, thread_id FROM users WHERE thread_id IS NOT NULL")
+            rows = await cur.fetchall()
+        self._user_threads = {tg_id: thread_id for tg_id, thread_id in rows}
+        self._thread_users = {thread_id: tg_id for tg_id, thread_id in rows}
+
+    async def _sync_user_changes(self) -> None:
+        if time.monotonic() - self._user_changes_checked_at < self.USER_CHANGES_POLL_INTERVAL:
+            return
+        self._user_changes_checked_at = time.monotonic()
+        async with self._connect() as db:
+            cur = await db.execute(
+                "SELECT seq, tg_id FROM user_changes WHERE seq > ? ORDER BY seq", (self._user_changes_seq,)
+            )
+            rows = await cur.fetchall()
+        for _, tg_id in rows:
+            self.user_cache.pop(tg_id)
+            self._forget_thread(tg_id)
+        if rows:
+            self._user_changes_seq = rows[-1][0]
+
+    async def get_user_thread(self, tg_id: int) -> int | None:
+        await self._sync_user_changes()
+        thread_id = self._user_threads.get(tg_id)
+        if thread_id is not None:
+            return thread_id
+        # The topic may have been created by another process
+        async with self._connect() as db:
+            cur = await db.execute("SELECT thread_id FROM users WHERE tg_id=? AND thread_id IS NOT NULL", (tg_id,))
+            row = await cur.fetchone()
+        if row:
+            self._remember_thread(tg_id, row[0])
+            return row[0]
+        return None
+
+    async def get_thread_user(self, thread_id: int) -> int | None:
+        await self._sync_user_changes()
+        tg_id = self._thread_users.get(thread_id)
+        if tg_id is not None:
+            return tg_id
+        async with self._connect() as db:
+            cur = await db.execute("SELECT tg_id FROM users WHERE thread_id=?", (thread_id,))
+            row = await cur.fetchone()
+        if row:
+            self._remember_thread(row[0], thread_id)
+            return row[0]
+        return None
+
+    async def _refresh_settings(self) -> None:
+        async with self._connect() as db:
+            # Version is read first, so a concurrent change is picked up on the next check
+            cur = await db.execute("SELECT version FROM settings_version WHERE id=1")
+            row = await cur.fetchone()
+            version = row[0] if row else 0
+            if version != self._settings_version:
+                cur = await db.execute("SELECT key, value FROM settings")
+                self._settings = {key: value for key, value in await cur.fetchall()}
+                self._settings_version = version
+        self._settings_checked_at = time.monotonic()
+
+    async def get_setting(self, key: str) -> str | None:
+        if time.monotonic() - self._settings_checked_at > self.SETTINGS_REFRESH_INTERVAL:
+            await self._refresh_settings()
+        return self._settings.get(key)
+
     async def set_setting(self, key: str, value: str) -> None:
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute(
                 "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
                 (key, value),
             )
-            await db.commit()
 
-    async def get_user_by_thread(self, thread_id: int) -> dict[str, Any] | None:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute("SELECT * FROM users WHERE thread_id=?", (thread_id,))
-            row = await cur.fetchone()
-            return dict(row) if row else None
+        await self._write(op)
+        self._settings[key] = value
 
-    async def get_user(self, tg_id: int) -> dict[str, Any] | None:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute("SELECT * FROM users WHERE tg_id=?", (tg_id,))
-            row = await cur.fetchone()
-            return dict(row) if row else None
+    async def get_user_by_thread(self, thread_id: int) -> UserRecord | None:
+        tg_id = await self.get_thread_user(thread_id)
+        return await self.get_user(tg_id) if tg_id is not None else None
+
+    async def get_user(self, tg_id: int) -> UserRecord | None:
+        await self._sync_user_changes()
+        cached = self.user_cache.get(tg_id)
+        if cached is not MISSING:
+            return cached
+        version = self.user_cache.version(tg_id)
+        async with self._connect() as db:
+            db.row_factory = UserRecord.row_factory
+            cur = await db.execute(f"SELECT {USER_COLUMNS} FROM users WHERE tg_id=?", (tg_id,))
+            user = await cur.fetchone()
+        self.user_cache.set(tg_id, user, version=version)
+        return user
 
     async def get_next_claim_number(self) -> int:
         """Get next claim number starting from 1"""
-        async with aiosqlite.connect(self.path) as db:
-            cur = await db.execute("SELECT MAX(CAST(id AS INTEGER)) FROM claims WHERE id GLOB '[0-9]*'")
+        async with self._connect() as db:
+            cur = await db.execute(
+                """
+                SELECT MAX(
+                    COALESCE((SELECT MAX(CAST(id AS INTEGER)) FROM claims WHERE id GLOB '[0-9]*'), 0),
+                    COALESCE((SELECT MAX(CAST(id AS INTEGER)) FROM claims_archive WHERE id GLOB '[0-9]*'), 0)
+                )
+                """
+            )
             row = await cur.fetchone()
             max_num = row[0] if row[0] else 0
             return max_num + 1
@@ -180,129 +1032,271 @@ class Database:
         description: str,
         purchase_type: str,
         purchase_value: str,
+        files: list[tuple[str, str]] = (),
+        notify: dict[str, Any] | None = None,
     ) -> None:
-        now = dt.datetime.utcnow().isoformat()
-        async with aiosqlite.connect(self.path) as db:
+        """files are (file_id, file_type) pairs.
+
+        With notify the admin notification is queued in the outbox in the
+        same transaction, so it is sent even if the bot stops right after.
+        """
+        now = dt.datetime.utcnow()
+        now_ts = to_epoch(now)
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute(
                 """
                 INSERT INTO claims
-                (id, tg_id, description, purchase_type, purchase_value, status, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                (id, tg_id, description, purchase_type, purchase_value, status, created_at, updated_at, created_ts, updated_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
-                (claim_id, tg_id, description, purchase_type, purchase_value, "Новая", now, now),
+                (claim_id, tg_id, description, purchase_type, purchase_value, "Новая", now.isoformat(), now.isoformat(), now_ts, now_ts),
             )
-            await db.commit()
+            if files:
+                await db.executemany(
+                    "INSERT INTO claim_files (claim_id, file_id, file_type) VALUES (?, ?, ?)",
+                    [(claim_id, file_id, file_type) for file_id, file_type in files],
+                )
+            if notify is not None:
+                await self._enqueue_outbox(
+                    db, NEW_CLAIM_EVENT, f"{NEW_CLAIM_EVENT}:{claim_id}", {"claim_id": claim_id, **notify}, now_ts
+                )
+
+        await self._write(op)
+        self.claim_cache.pop(tg_id)
 
     async def add_claim_file(self, claim_id: str, file_id: str, file_type: str) -> None:
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute(
                 "INSERT INTO claim_files (claim_id, file_id, file_type) VALUES (?, ?, ?)",
                 (claim_id, file_id, file_type),
             )
-            await db.commit()
 
-    async def list_claims_by_user(self, tg_id: int | None, limit: int = 5) -> list[dict[str, Any]]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
+        await self._write(op)
+
+    async def list_claims_by_user(self, tg_id: int | None, limit: int = 5) -> list[ClaimRecord]:
+        async with self._connect() as db:
+            db.row_factory = ClaimRecord.row_factory
             if tg_id:
                 cur = await db.execute(
-                    "SELECT * FROM claims WHERE tg_id=? ORDER BY created_at DESC LIMIT ?",
+                    f"SELECT {CLAIM_COLUMNS} FROM claims WHERE tg_id=? ORDER BY created_ts DESC, CAST(id AS INTEGER) DESC LIMIT ?",
                     (tg_id, limit),
                 )
             else:
                 cur = await db.execute(
-                    "SELECT * FROM claims ORDER BY created_at DESC LIMIT ?",
+                    f"SELECT {CLAIM_COLUMNS} FROM claims ORDER BY created_ts DESC, CAST(id AS INTEGER) DESC, id DESC LIMIT ?",
                     (limit,),
                 )
-            rows = await cur.fetchall()
-            return [dict(row) for row in rows]
+            return list(await cur.fetchall())
 
-    async def get_claim(self, claim_id: str) -> dict[str, Any] | None:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute("SELECT * FROM claims WHERE id=?", (claim_id,))
+    async def get_claim(self, claim_id: str) -> ClaimRecord | None:
+        async with self._connect() as db:
+            db.row_factory = ClaimRecord.row_factory
+            cur = await db.execute(f"SELECT {CLAIM_COLUMNS} FROM claims WHERE id=?", (claim_id,))
             row = await cur.fetchone()
-            return dict(row) if row else None
+            if not row:
+                cur = await db.execute(f"SELECT {CLAIM_COLUMNS} FROM claims_archive WHERE id=?", (claim_id,))
+                row = await cur.fetchone()
+            return row
 
-    async def get_claim_files(self, claim_id: str) -> list[dict[str, Any]]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_claim_files(self, claim_id: str) -> list[ClaimFileRecord]:
+        async with self._connect() as db:
+            db.row_factory = ClaimFileRecord.row_factory
             cur = await db.execute(
-                "SELECT * FROM claim_files WHERE claim_id=?", (claim_id,)
+                f"SELECT {CLAIM_FILE_COLUMNS} FROM claim_files WHERE claim_id=?", (claim_id,)
             )
             rows = await cur.fetchall()
-            return [dict(row) for row in rows]
+            if not rows:
+                cur = await db.execute(
+                    f"SELECT {CLAIM_FILE_COLUMNS} FROM claim_files_archive WHERE claim_id=?", (claim_id,)
+                )
+                rows = await cur.fetchall()
+            return list(rows)
+
+    @staticmethod
+    async def _unarchive_claim(db: aiosqlite.Connection, claim_id: str) -> None:
+        # A change to an archived claim (e.g. reopening it) brings it back to the hot tables
+        cur = await db.execute("SELECT 1 FROM claims_archive WHERE id=?", (claim_id,))
+        if await cur.fetchone() is None:
+            return
+        await db.execute(f"INSERT INTO claims ({CLAIM_COLUMNS}) SELECT {CLAIM_COLUMNS} FROM claims_archive WHERE id=?", (claim_id,))
+        await db.execute(
+            f"INSERT INTO claim_files ({CLAIM_FILE_COLUMNS}) SELECT {CLAIM_FILE_COLUMNS} FROM claim_files_archive WHERE claim_id=?",
+            (claim_id,),
+        )
+        await db.execute(
+            f"INSERT INTO claim_notes ({CLAIM_NOTE_COLUMNS}) SELECT {CLAIM_NOTE_COLUMNS} FROM claim_notes_archive WHERE claim_id=?",
+            (claim_id,),
+        )
+        await db.execute("DELETE FROM claim_files_archive WHERE claim_id=?", (claim_id,))
+        await db.execute("DELETE FROM claim_notes_archive WHERE claim_id=?", (claim_id,))
+        await db.execute("DELETE FROM claims_archive WHERE id=?", (claim_id,))
 
     async def update_claim_status(self, claim_id: str, status: str) -> None:
-        now = dt.datetime.utcnow().isoformat()
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute(
-                "UPDATE claims SET status=?, updated_at=? WHERE id=?",
-                (status, now, claim_id),
+        now = dt.datetime.utcnow()
+        async def op(db: aiosqlite.Connection) -> list[tuple[int]]:
+            await self._unarchive_claim(db, claim_id)
+            cur = await db.execute(
+                "UPDATE claims SET status=?, updated_at=?, updated_ts=? WHERE id=? RETURNING tg_id",
+                (status, now.isoformat(), to_epoch(now), claim_id),
             )
-            await db.commit()
+            return await cur.fetchall()
+
+        self._claim_changed(await self._write(op))
 
     async def update_claim_comment(self, claim_id: str, comment: str) -> None:
-        now = dt.datetime.utcnow().isoformat()
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute(
-                "UPDATE claims SET manager_comment=?, updated_at=? WHERE id=?",
-                (comment, now, claim_id),
+        now = dt.datetime.utcnow()
+        async def op(db: aiosqlite.Connection) -> list[tuple[int]]:
+            await self._unarchive_claim(db, claim_id)
+            cur = await db.execute(
+                "UPDATE claims SET manager_comment=?, updated_at=?, updated_ts=? WHERE id=? RETURNING tg_id",
+                (comment, now.isoformat(), to_epoch(now), claim_id),
             )
-            await db.commit()
+            return await cur.fetchall()
+
+        self._claim_changed(await self._write(op))
 
     async def update_claim_group_message(self, claim_id: str, message_id: int) -> None:
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute(
-                "UPDATE claims SET group_message_id=? WHERE id=?",
+        async def op(db: aiosqlite.Connection) -> list[tuple[int]]:
+            cur = await db.execute(
+                "UPDATE claims SET group_message_id=? WHERE id=? RETURNING tg_id",
                 (message_id, claim_id),
             )
-            await db.commit()
+            return await cur.fetchall()
+
+        self._claim_changed(await self._write(op))
+
+    def _claim_changed(self, rows: list[tuple[int]]) -> None:
+        # rows are (tg_id,) returned by the UPDATE
+        for (tg_id,) in rows:
+            self.claim_cache.pop(tg_id)
 
     async def add_claim_note(self, claim_id: str, author: str, text: str) -> None:
-        now = dt.datetime.utcnow().isoformat()
-        async with aiosqlite.connect(self.path) as db:
+        now = dt.datetime.utcnow()
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute(
-                "INSERT INTO claim_notes (claim_id, author, text, created_at) VALUES (?, ?, ?, ?)",
-                (claim_id, author, text, now),
+                "INSERT INTO claim_notes (claim_id, author, text, created_at, created_ts) VALUES (?, ?, ?, ?, ?)",
+                (claim_id, author, text, now.isoformat(), to_epoch(now)),
             )
-            await db.commit()
 
-    async def get_last_claim_by_status(self, tg_id: int, status: str) -> dict[str, Any] | None:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
+        await self._write(op)
+
+    async def get_last_claim_by_status(self, tg_id: int, status: str) -> ClaimRecord | None:
+        async with self._connect() as db:
+            db.row_factory = ClaimRecord.row_factory
             cur = await db.execute(
-                "SELECT * FROM claims WHERE tg_id=? AND status=? ORDER BY updated_at DESC LIMIT 1",
+                f"SELECT {CLAIM_COLUMNS} FROM claims WHERE tg_id=? AND status=? ORDER BY updated_ts DESC, CAST(id AS INTEGER) DESC LIMIT 1",
                 (tg_id, status),
             )
-            row = await cur.fetchone()
-            return dict(row) if row else None
+            return await cur.fetchone()
 
-    async def get_last_claim(self, tg_id: int) -> dict[str, Any] | None:
+    async def _sync_claim_changes(self) -> None:
+        if time.monotonic() - self._claim_changes_checked_at < self.CLAIM_CHANGES_POLL_INTERVAL:
+            return
+        self._claim_changes_checked_at = time.monotonic()
+        async with self._connect() as db:
+            cur = await db.execute(
+                "SELECT seq, tg_id FROM claim_changes WHERE seq > ? ORDER BY seq", (self._claim_changes_seq,)
+            )
+            rows = await cur.fetchall()
+        for _, tg_id in rows:
+            self.claim_cache.pop(tg_id)
+        if rows:
+            self._claim_changes_seq = rows[-1][0]
+
+    async def get_last_claim(self, tg_id: int) -> ClaimRecord | None:
         """Get last claim for user regardless of status"""
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
+        await self._sync_claim_changes()
+        cached = self.claim_cache.get(tg_id)
+        if cached is not MISSING:
+            return cached
+        version = self.claim_cache.version(tg_id)
+        async with self._connect() as db:
+            db.row_factory = ClaimRecord.row_factory
             cur = await db.execute(
-                "SELECT * FROM claims WHERE tg_id=? ORDER BY updated_at DESC LIMIT 1",
+                f"SELECT {CLAIM_COLUMNS} FROM claims WHERE tg_id=? ORDER BY updated_ts DESC, CAST(id AS INTEGER) DESC LIMIT 1",
                 (tg_id,),
             )
-            row = await cur.fetchone()
-            return dict(row) if row else None
+            claim = await cur.fetchone()
+        self.claim_cache.set(tg_id, claim, version=version)
+        return claim
+
+    async def purge_claim_changes(self, older_than_ts: int, batch_size: int = 1000) -> int:
+        async def op(db: aiosqlite.Connection) -> int:
+            cur = await db.execute(
+                "DELETE FROM claim_changes WHERE seq IN (SELECT seq FROM claim_changes WHERE changed_ts < ? LIMIT ?)",
+                (older_than_ts, batch_size),
+            )
+            return cur.rowcount
+
+        return await self._write(op)
+
+    async def purge_user_changes(self, older_than_ts: int, batch_size: int = 1000) -> int:
+        async def op(db: aiosqlite.Connection) -> int:
+            cur = await db.execute(
+                "DELETE FROM user_changes WHERE seq IN (SELECT seq FROM user_changes WHERE changed_ts < ? LIMIT ?)",
+                (older_than_ts, batch_size),
+            )
+            return cur.rowcount
+
+        return await self._write(op)
 
     async def add_cz_code(self, tg_id: int, cz_code: str) -> None:
         now = dt.datetime.utcnow().isoformat()
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute(
                 "INSERT INTO cz_codes (tg_id, cz_code, created_at) VALUES (?, ?, ?)",
                 (tg_id, cz_code, now),
             )
-            await db.commit()
+
+        await self._write(op)
 
     async def is_cz_registered(self, cz_code: str) -> bool:
-        async with aiosqlite.connect(self.path) as db:
-            cur = await db.execute("SELECT 1 FROM warranties WHERE cz_code=? LIMIT 1", (cz_code,))
-            row = await cur.fetchone()
-            return row is not None
+        """Whether the code, a code it is a prefix of, or a prefix of it is registered.
+
+        Typed codes are only the first digits of the printed code, so a typed
+        prefix and the full scanned code refer to the same item.
+        """
+        key = normalize_cz_code(cz_code)
+        if not key:
+            return False
+        async with self._connect() as db:
+            if len(key) >= CZ_MIN_PREFIX:
+                cur = await db.execute(
+                    "SELECT 1 FROM warranties WHERE cz_key >= ? AND cz_key < ? LIMIT 1",
+                    (key, _prefix_upper_bound(key)),
+                )
+            else:
+                cur = await db.execute("SELECT 1 FROM warranties WHERE cz_key=? LIMIT 1", (key,))
+            if await cur.fetchone() is not None:
+                return True
+
+            prefixes = [key[:n] for n in range(CZ_MIN_PREFIX, len(key))]
+            if not prefixes:
+                return False
+            placeholders = ",".join(["?"] * len(prefixes))
+            cur = await db.execute(
+                f"SELECT 1 FROM warranties WHERE cz_key IN ({placeholders}) LIMIT 1", prefixes
+            )
+            return await cur.fetchone() is not None
+
+    async def find_warranties_by_code_prefix(self, prefix: str, limit: int = 10) -> list[WarrantyRecord]:
+        key = normalize_cz_code(prefix)
+        if not key:
+            return []
+        async with self._connect() as db:
+            db.row_factory = WarrantyRecord.row_factory
+            cur = await db.execute(
+                f"""
+                SELECT {_qualified(WARRANTY_COLUMNS, "w")}, u.username, u.name
+                FROM warranties w
+                LEFT JOIN users u ON w.tg_id = u.tg_id
+                WHERE w.cz_key >= ? AND w.cz_key < ?
+                ORDER BY w.cz_key
+                LIMIT ?
+                """,
+                (key, _prefix_upper_bound(key), limit),
+            )
+            return list(await cur.fetchall())
 
     async def create_warranty(
         self,
@@ -331,17 +1325,19 @@ class Database:
             start = now.date()
 
         end = start.replace(year=start.year + 1)
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute(
                 """
                 INSERT INTO warranties
-                (id, tg_id, cz_code, cz_file_id, receipt_file_id, sku, receipt_date, receipt_text, receipt_items, start_date, end_date, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                (id, tg_id, cz_code, cz_key, cz_file_id, receipt_file_id, sku, receipt_date, receipt_text, receipt_items,
+                 start_date, end_date, created_at, start_ts, end_ts, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     warranty_id,
                     tg_id,
                     cz_code,
+                    normalize_cz_code(cz_code),
                     cz_file_id,
                     receipt_file_id,
                     sku,
@@ -351,79 +1347,870 @@ class Database:
                     start.isoformat(),
                     end.isoformat(),
                     now.isoformat(),
+                    to_epoch(start),
+                    to_epoch(end),
+                    to_epoch(now),
                 ),
             )
-            await db.commit()
+
+        await self._write(op)
         return start.isoformat(), end.isoformat()
 
     async def has_warranty(self, tg_id: int) -> bool:
-        async with aiosqlite.connect(self.path) as db:
+        async with self._connect() as db:
             cur = await db.execute("SELECT 1 FROM warranties WHERE tg_id=? LIMIT 1", (tg_id,))
             row = await cur.fetchone()
             return row is not None
 
-    async def get_warranties(self, tg_id: int) -> list[dict[str, Any]]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
-            cur = await db.execute("SELECT * FROM warranties WHERE tg_id=?", (tg_id,))
-            rows = await cur.fetchall()
-            return [dict(row) for row in rows]
+    async def get_warranties(self, tg_id: int) -> list[WarrantyRecord]:
+        async with self._connect() as db:
+            db.row_factory = WarrantyRecord.row_factory
+            cur = await db.execute(f"SELECT {WARRANTY_COLUMNS} FROM warranties WHERE tg_id=?", (tg_id,))
+            return list(await cur.fetchall())
 
-    async def list_claims_with_threads(self, status: str | None = None, limit: int = 20, offset: int = 0) -> list[dict[str, Any]]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
+    async def list_claims_with_threads(
+        self,
+        status: str | None = None,
+        limit: int = 20,
+        after: tuple[int, str] | None = None,
+        before: tuple[int, str] | None = None,
+    ) -> list[ClaimRecord]:
+        """Page through claims newest first using a (created_ts, claim number, id) keyset.
+
+        after is the (created_ts, id) of a claim and returns the claims listed
+        after it (older ones), before the claims listed before it (newer ones).
+        The claim itself doesn't have to exist any more.
+        """
+        where = []
+        params: list[Any] = []
+        if status:
+            where.append("c.status=?")
+            params.append(status)
+        order = "DESC"
+        if after:
+            where.append("(c.created_ts, CAST(c.id AS INTEGER), c.id) < (?, CAST(? AS INTEGER), ?)")
+            params.extend((after[0], after[1], after[1]))
+        elif before:
+            where.append("(c.created_ts, CAST(c.id AS INTEGER), c.id) > (?, CAST(? AS INTEGER), ?)")
+            params.extend((before[0], before[1], before[1]))
+            order = "ASC"
+        where_sql = f"WHERE {' AND '.join(where)}" if where else ""
+        params.append(limit)
+
+        async with self._connect() as db:
+            db.row_factory = ClaimRecord.row_factory
+            cur = await db.execute(
+                f"SELECT {_qualified(CLAIM_COLUMNS, 'c')}, u.thread_id FROM claims c LEFT JOIN users u ON c.tg_id = u.tg_id "
+                f"{where_sql} ORDER BY c.created_ts {order}, CAST(c.id AS INTEGER) {order}, c.id {order} LIMIT ?",
+                params,
+            )
+            claims = list(await cur.fetchall())
+        if order == "ASC":
+            claims.reverse()
+        return claims
+
+    async def count_claims(self, status: str | None = None) -> int:
+        """Claims in the hot table, i.e. the ones list_claims_with_threads pages through."""
+        async with self._connect() as db:
             if status:
+                cur = await db.execute("SELECT count - archived FROM claim_counters WHERE status=?", (status,))
+            else:
+                cur = await db.execute("SELECT COALESCE(SUM(count - archived), 0) FROM claim_counters")
+            row = await cur.fetchone()
+            return row[0] if row else 0
+
+    async def list_warranties_ending_between(
+        self,
+        from_ts: int,
+        to_ts: int,
+        limit: int = 500,
+        after: tuple[int, str] | None = None,
+    ) -> list[WarrantyRecord]:
+        """Warranties with from_ts <= end_ts < to_ts, ordered by (end_ts, id).
+
+        after is the (end_ts, id) of the last row of the previous batch.
+        """
+        async with self._connect() as db:
+            db.row_factory = WarrantyRecord.row_factory
+            if after:
                 cur = await db.execute(
-                    "SELECT c.*, u.thread_id FROM claims c LEFT JOIN users u ON c.tg_id = u.tg_id WHERE c.status=? ORDER BY c.created_at DESC LIMIT ? OFFSET ?",
-                    (status, limit, offset),
+                    f"""
+                    SELECT {WARRANTY_COLUMNS} FROM warranties
+                    WHERE end_ts >= ? AND end_ts < ? AND (end_ts, id) > (?, ?)
+                    ORDER BY end_ts, id LIMIT ?
+                    """,
+                    (from_ts, to_ts, after[0], after[1], limit),
                 )
             else:
                 cur = await db.execute(
-                    "SELECT c.*, u.thread_id FROM claims c LEFT JOIN users u ON c.tg_id = u.tg_id ORDER BY c.created_at DESC LIMIT ? OFFSET ?",
-                    (limit, offset),
+                    f"SELECT {WARRANTY_COLUMNS} FROM warranties WHERE end_ts >= ? AND end_ts < ? ORDER BY end_ts, id LIMIT ?",
+                    (from_ts, to_ts, limit),
                 )
-            rows = await cur.fetchall()
-            return [dict(row) for row in rows]
+            return list(await cur.fetchall())
 
-    async def count_claims(self, status: str | None = None) -> int:
-        async with aiosqlite.connect(self.path) as db:
-            if status:
-                cur = await db.execute("SELECT COUNT(*) FROM claims WHERE status=?", (status,))
-            else:
-                cur = await db.execute("SELECT COUNT(*) FROM claims")
-            row = await cur.fetchone()
-            return row[0] if row else 0
+    async def list_reminders_due(self, from_ts: int, to_ts: int, limit: int = 500) -> list[WarrantyRecord]:
+        """Warranties with from_ts <= end_ts < to_ts that got no reminder yet, ordered by (end_ts, id)."""
+        async with self._connect() as db:
+            db.row_factory = WarrantyRecord.row_factory
+            cur = await db.execute(
+                f"""
+                SELECT {WARRANTY_COLUMNS} FROM warranties
+                WHERE end_ts >= ? AND end_ts < ? AND reminder_sent_ts IS NULL
+                ORDER BY end_ts, id LIMIT ?
+                """,
+                (from_ts, to_ts, limit),
+            )
+            return list(await cur.fetchall())
 
-    async def get_unsynced_warranties(self) -> list[dict[str, Any]]:
-        async with aiosqlite.connect(self.path) as db:
-            db.row_factory = aiosqlite.Row
+    async def mark_reminders_sent(self, warranty_ids: list[str]) -> None:
+        if not warranty_ids:
+            return
+        now_ts = to_epoch(dt.datetime.utcnow())
+        async def op(db: aiosqlite.Connection) -> None:
+            placeholders = ",".join(["?"] * len(warranty_ids))
+            await db.execute(
+                f"UPDATE warranties SET reminder_sent_ts=? WHERE id IN ({placeholders})",
+                [now_ts, *warranty_ids],
+            )
+
+        await self._write(op)
+
+    async def archive_closed_claims(self, older_than_ts: int, batch_size: int = 500) -> int:
+        """Move one batch of claims closed before older_than_ts to the archive tables.
+
+        Returns the number of archived claims; call again until it returns 0.
+        """
+        statuses = ",".join(["?"] * len(CLOSED_CLAIM_STATUSES))
+
+        async def op(db: aiosqlite.Connection) -> int:
+            # A user's last claim stays: get_last_claim and the message relay only read claims
             cur = await db.execute(
-                """
-                SELECT w.*, u.username, u.email 
-                FROM warranties w 
-                LEFT JOIN users u ON w.tg_id = u.tg_id 
-                WHERE w.synced = 0
-                """
+                f"""
+                SELECT id FROM claims
+                WHERE status IN ({statuses}) AND updated_ts < ?
+                AND EXISTS (
+                    SELECT 1 FROM claims newer
+                    WHERE newer.tg_id = claims.tg_id
+                    AND (newer.updated_ts, CAST(newer.id AS INTEGER)) > (claims.updated_ts, CAST(claims.id AS INTEGER))
+                )
+                LIMIT ?
+                """,
+                (*CLOSED_CLAIM_STATUSES, older_than_ts, batch_size),
             )
-            rows = await cur.fetchall()
-            return [dict(row) for row in rows]
+            ids = [row[0] for row in await cur.fetchall()]
+            if not ids:
+                return 0
+            placeholders = ",".join(["?"] * len(ids))
+            now_ts = to_epoch(dt.datetime.utcnow())
+            await db.execute(
+                f"""
+                INSERT OR REPLACE INTO claims_archive ({CLAIM_COLUMNS}, archived_ts)
+                SELECT {CLAIM_COLUMNS}, ? FROM claims WHERE id IN ({placeholders})
+                """,
+                (now_ts, *ids),
+            )
+            await db.execute(
+                f"""
+                INSERT OR REPLACE INTO claim_files_archive ({CLAIM_FILE_COLUMNS})
+                SELECT {CLAIM_FILE_COLUMNS} FROM claim_files WHERE claim_id IN ({placeholders})
+                """,
+                ids,
+            )
+            await db.execute(
+                f"""
+                INSERT OR REPLACE INTO claim_notes_archive ({CLAIM_NOTE_COLUMNS})
+                SELECT {CLAIM_NOTE_COLUMNS} FROM claim_notes WHERE claim_id IN ({placeholders})
+                """,
+                ids,
+            )
+            await db.execute(f"DELETE FROM claim_files WHERE claim_id IN ({placeholders})", ids)
+            await db.execute(f"DELETE FROM claim_notes WHERE claim_id IN ({placeholders})", ids)
+            await db.execute(f"DELETE FROM claims WHERE id IN ({placeholders})", ids)
+            return len(ids)
+
+        return await self._write(op)
+
+    async def list_stale_claims(self, status: str, older_than_ts: int, limit: int = 100) -> list[ClaimRecord]:
+        """Oldest claims still in the given status that were created before older_than_ts."""
+        async with self._connect() as db:
+            db.row_factory = ClaimRecord.row_factory
+            cur = await db.execute(
+                f"SELECT {CLAIM_COLUMNS} FROM claims WHERE status=? AND created_ts < ? ORDER BY created_ts, CAST(id AS INTEGER), id LIMIT ?",
+                (status, older_than_ts, limit),
+            )
+            return list(await cur.fetchall())
+
+    async def get_unsynced_warranties(self, limit: int = 1000, after_id: str | None = None) -> list[WarrantyRecord]:
+        """One page of not yet synced warranties in id order, starting after after_id."""
+        async with self._connect() as db:
+            db.row_factory = WarrantyRecord.row_factory
+            cur = await db.execute(
+                f"""
+                SELECT {_qualified(WARRANTY_COLUMNS, "w")}, u.username, u.name, u.email
+                FROM warranties w
+                LEFT JOIN users u ON w.tg_id = u.tg_id
+                WHERE w.synced = 0 AND w.id > ?
+                ORDER BY w.id
+                LIMIT ?
+                """,
+                (after_id or "", limit),
+            )
+            return list(await cur.fetchall())
+
+    async def iter_unsynced_warranties(self, batch_size: int = 1000) -> AsyncIterator[list[WarrantyRecord]]:
+        """Stream not yet synced warranties in batches; each batch is a separate short read."""
+        after_id = None
+        while True:
+            batch = await self.get_unsynced_warranties(limit=batch_size, after_id=after_id)
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            after_id = batch[-1].id
 
     async def mark_as_synced(self, warranty_ids: list[str]) -> None:
         if not warranty_ids:
             return
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             placeholders = ",".join(["?"] * len(warranty_ids))
             await db.execute(
                 f"UPDATE warranties SET synced = 1 WHERE id IN ({placeholders})",
                 warranty_ids
             )
-            await db.commit()
+
+        await self._write(op)
 
     async def delete_user_data(self, tg_id: int) -> None:
-        async with aiosqlite.connect(self.path) as db:
+        async def op(db: aiosqlite.Connection) -> None:
             await db.execute("DELETE FROM users WHERE tg_id=?", (tg_id,))
+            await db.execute(
+                "DELETE FROM claim_files_archive WHERE claim_id IN (SELECT id FROM claims_archive WHERE tg_id=?)", (tg_id,)
+            )
+            await db.execute(
+                "DELETE FROM claim_notes_archive WHERE claim_id IN (SELECT id FROM claims_archive WHERE tg_id=?)", (tg_id,)
+            )
+            await db.execute("DELETE FROM claims_archive WHERE tg_id=?", (tg_id,))
+            await db.execute("DELETE FROM claim_files WHERE claim_id IN (SELECT id FROM claims WHERE tg_id=?)", (tg_id,))
+            await db.execute("DELETE FROM claim_notes WHERE claim_id IN (SELECT id FROM claims WHERE tg_id=?)", (tg_id,))
             await db.execute("DELETE FROM claims WHERE tg_id=?", (tg_id,))
             await db.execute("DELETE FROM warranties WHERE tg_id=?", (tg_id,))
             await db.execute("DELETE FROM cz_codes WHERE tg_id=?", (tg_id,))
-            await db.commit()
+            await db.execute("DELETE FROM broadcast_deliveries WHERE tg_id=?", (tg_id,))
+
+        await self._write(op)
+        self.user_cache.pop(tg_id)
+        self.claim_cache.pop(tg_id)
+        self._forget_thread(tg_id)
+
+    async def backup(self, dest_path: str, pages: int = 256, sleep: float = 0.05) -> None:
+        """Online copy of the database via the SQLite backup API.
+
+        Pages are copied in small steps. The source keeps one read transaction
+        open for the whole copy, so the backup is a consistent snapshot and is
+        not restarted by concurrent writes; in WAL mode writers are not blocked.
+        """
+        def run() -> None:
+            src = sqlite3.connect(self.path, isolation_level=None)
+            dst = sqlite3.connect(dest_path)
+            try:
+                src.execute("BEGIN")
+                src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+                src.backup(dst, pages=pages, sleep=sleep)
+                src.execute("COMMIT")
+                # Keep the copy a single self-contained file
+                dst.execute("PRAGMA journal_mode=DELETE")
+            finally:
+                dst.close()
+                src.close()
+
+        await asyncio.to_thread(run)
+
+    async def free_pages(self) -> tuple[str, int]:
+        """Auto-vacuum mode and the number of free pages in the file."""
+        async with self._connect() as db:
+            cur = await db.execute("PRAGMA auto_vacuum")
+            mode = (await cur.fetchone())[0]
+            cur = await db.execute("PRAGMA freelist_count")
+            count = (await cur.fetchone())[0]
+        return {0: "none", 1: "full", 2: "incremental"}.get(mode, str(mode)), count
+
+    async def incremental_vacuum(self, pages: int = 1000) -> None:
+        async def op(db: aiosqlite.Connection) -> None:
+            # The pragma frees one page per step, so it has to be run to completion
+            cur = await db.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+            await cur.fetchall()
+            await cur.close()
+
+        await self._write(op)
+
+    async def optimize(self, analysis_limit: int = 1000) -> None:
+        """Refresh planner statistics; analysis_limit keeps ANALYZE cheap on big tables."""
+        async def op(db: aiosqlite.Connection) -> None:
+            await db.execute(f"PRAGMA analysis_limit={int(analysis_limit)}")
+            cur = await db.execute("SELECT 1 FROM sqlite_master WHERE name='sqlite_stat1'")
+            # optimize only re-analyzes tables that already have statistics
+            if await cur.fetchone():
+                await db.execute("PRAGMA optimize")
+            else:
+                await db.execute("ANALYZE")
+
+        await self._write(op)
+
+    async def sweep_orphans(self, batch_size: int = 1000) -> int:
+        """Delete up to batch_size files and notes per table whose claim no longer exists."""
+        async def op(db: aiosqlite.Connection) -> int:
+            removed = 0
+            for table in ("claim_files", "claim_notes", "claim_files_archive", "claim_notes_archive"):
+                cur = await db.execute(
+                    f"""
+                    DELETE FROM {table} WHERE rowid IN (
+                        SELECT t.rowid FROM {table} t
+                        WHERE NOT EXISTS (SELECT 1 FROM claims c WHERE c.id = t.claim_id)
+                          AND NOT EXISTS (SELECT 1 FROM claims_archive a WHERE a.id = t.claim_id)
+                        LIMIT ?
+                    )
+                    """,
+                    (batch_size,),
+                )
+                removed += cur.rowcount
+            return removed
+
+        return await self._write(op)
+
+    async def get_fsm_state(self, key: str) -> tuple[str | None, str | None] | None:
+        """(state, data as JSON) stored for an FSM key."""
+        async with self._connect() as db:
+            cur = await db.execute("SELECT state, data FROM fsm_states WHERE key=?", (key,))
+            return await cur.fetchone()
+
+    async def save_fsm_states(self, items: list[tuple[str, str | None, str | None]]) -> None:
+        """Write (key, state, data JSON) rows in one go; rows without state and data are removed."""
+        if not items:
+            return
+        now_ts = to_epoch(dt.datetime.utcnow())
+        upserts = [(key, state, data, now_ts) for key, state, data in items if state is not None or data]
+        deletes = [(key,) for key, state, data in items if state is None and not data]
+        async def op(db: aiosqlite.Connection) -> None:
+            if upserts:
+                await db.executemany(
+                    """
+                    INSERT INTO fsm_states (key, state, data, updated_ts) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        state=excluded.state, data=excluded.data, updated_ts=excluded.updated_ts
+                    """,
+                    upserts,
+                )
+            if deletes:
+                await db.executemany("DELETE FROM fsm_states WHERE key=?", deletes)
+
+        await self._write(op)
+
+    async def purge_fsm_states(self, older_than_ts: int, batch_size: int = 1000) -> int:
+        """Delete up to batch_size FSM sessions not touched since older_than_ts."""
+        async def op(db: aiosqlite.Connection) -> int:
+            cur = await db.execute(
+                """
+                DELETE FROM fsm_states WHERE key IN (
+                    SELECT key FROM fsm_states WHERE updated_ts < ? ORDER BY updated_ts LIMIT ?
+                )
+                """,
+                (older_than_ts, batch_size),
+            )
+            return cur.rowcount
+
+        return await self._write(op)
+
+    @staticmethod
+    async def _enqueue_outbox(db: aiosqlite.Connection, kind: str, key: str, payload: dict[str, Any], now_ts: int) -> None:
+        # key is the idempotency key: the same notification is never queued twice
+        await db.execute(
+            """
+            INSERT INTO outbox (kind, key, payload, next_attempt_ts, created_ts) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO NOTHING
+            """,
+            (kind, key, json.dumps(payload, ensure_ascii=False), now_ts, now_ts),
+        )
+
+    async def get_due_outbox(self, now_ts: int, limit: int = 50) -> list[OutboxRecord]:
+        async with self._connect() as db:
+            db.row_factory = OutboxRecord.row_factory
+            cur = await db.execute(
+                f"""
+                SELECT {OUTBOX_COLUMNS} FROM outbox
+                WHERE status = 'pending' AND next_attempt_ts <= ?
+                ORDER BY next_attempt_ts, id LIMIT ?
+                """,
+                (now_ts, limit),
+            )
+            return list(await cur.fetchall())
+
+    async def finish_outbox(
+        self, delivered: list[int], retried: list[tuple[str, int, int, str, str | None, int]]
+    ) -> None:
+        """Remove delivered entries and reschedule the rest in one transaction.
+
+        retried items are (status, attempts, next_attempt_ts, done, last_error, id).
+        """
+        if not delivered and not retried:
+            return
+        async def op(db: aiosqlite.Connection) -> None:
+            await db.executemany("DELETE FROM outbox WHERE id=?", [(entry_id,) for entry_id in delivered])
+            await db.executemany(
+                "UPDATE outbox SET status=?, attempts=?, next_attempt_ts=?, done=?, last_error=? WHERE id=?",
+                retried,
+            )
+
+        await self._write(op)
+
+    async def count_outbox(self) -> dict[str, int]:
+        async with self._connect() as db:
+            cur = await db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+            return {status: count for status, count in await cur.fetchall()}
+
+    async def create_broadcast(self, from_chat_id: int, message_id: int, created_by: int) -> int:
+        now_ts = to_epoch(dt.datetime.utcnow())
+        async def op(db: aiosqlite.Connection) -> int:
+            cur = await db.execute(
+                "INSERT INTO broadcasts (from_chat_id, message_id, created_by, created_ts) VALUES (?, ?, ?, ?)",
+                (from_chat_id, message_id, created_by, now_ts),
+            )
+            return cur.lastrowid
+
+        return await self._write(op)
+
+    async def set_broadcast_status(self, broadcast_id: int, status: str, from_statuses: tuple[str, ...]) -> bool:
+        """Change the status only from one of from_statuses; returns whether it changed."""
+        placeholders = ",".join(["?"] * len(from_statuses))
+        finished_ts = to_epoch(dt.datetime.utcnow()) if status in ("done", "cancelled") else None
+        async def op(db: aiosqlite.Connection) -> bool:
+            cur = await db.execute(
+                f"UPDATE broadcasts SET status=?, finished_ts=? WHERE id=? AND status IN ({placeholders})",
+                (status, finished_ts, broadcast_id, *from_statuses),
+            )
+            return cur.rowcount > 0
+
+        return await self._write(op)
+
+    async def get_broadcast(self, broadcast_id: int) -> BroadcastRecord | None:
+        async with self._connect() as db:
+            db.row_factory = BroadcastRecord.row_factory
+            cur = await db.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE id=?", (broadcast_id,))
+            return await cur.fetchone()
+
+    async def list_broadcasts(self, status: str | None = None, limit: int = 5) -> list[BroadcastRecord]:
+        """Newest first; with status, oldest first (the order they are sent in)."""
+        async with self._connect() as db:
+            db.row_factory = BroadcastRecord.row_factory
+            if status:
+                cur = await db.execute(
+                    f"SELECT {BROADCAST_COLUMNS} FROM broadcasts WHERE status=? ORDER BY id LIMIT ?", (status, limit)
+                )
+            else:
+                cur = await db.execute(f"SELECT {BROADCAST_COLUMNS} FROM broadcasts ORDER BY id DESC LIMIT ?", (limit,))
+            return list(await cur.fetchall())
 
+    async def count_broadcast_recipients(self) -> int:
+        async with self._connect() as db:
+            cur = await db.execute("SELECT COUNT(DISTINCT tg_id) FROM warranties")
+            return (await cur.fetchone())[0]
+
+    async def list_broadcast_recipients(self, after_tg_id: int, limit: int = 100) -> list[int]:
+        """Warranty holders in tg_id order after after_tg_id (keyset paging over idx_warranties_tg_id)."""
+        async with self._connect() as db:
+            cur = await db.execute(
+                "SELECT DISTINCT tg_id FROM warranties WHERE tg_id > ? ORDER BY tg_id LIMIT ?", (after_tg_id, limit)
+            )
+            return [row[0] for row in await cur.fetchall()]
+
+    async def take_broadcast_batch(self, broadcast_id: int, tg_ids: list[int]) -> None:
+        """Mark a batch as pending and move the cursor past it before sending.
+
+        After a crash the batch is not sent again: pending recipients are
+        reported as unknown rather than messaged twice.
+        """
+        now_ts = to_epoch(dt.datetime.utcnow())
+        async def op(db: aiosqlite.Connection) -> None:
+            await db.executemany(
+                "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, tg_id, status, updated_ts) VALUES (?, ?, 'pending', ?)",
+                [(broadcast_id, tg_id, now_ts) for tg_id in tg_ids],
+            )
+            await db.execute("UPDATE broadcasts SET cursor=? WHERE id=?", (max(tg_ids), broadcast_id))
+
+        await self._write(op)
+
+    async def save_broadcast_results(self, broadcast_id: int, results: list[tuple[int, str, str | None]]) -> None:
+        """results are (tg_id, status, error)."""
+        now_ts = to_epoch(dt.datetime.utcnow())
+        async def op(db: aiosqlite.Connection) -> None:
+            await db.executemany(
+                "UPDATE broadcast_deliveries SET status=?, error=?, updated_ts=? WHERE broadcast_id=? AND tg_id=?",
+                [(status, error, now_ts, broadcast_id, tg_id) for tg_id, status, error in results],
+            )
+
+        await self._write(op)
+
+    async def get_broadcast_stats(self, broadcast_id: int) -> dict[str, int]:
+        async with self._connect() as db:
+            cur = await db.execute(
+                "SELECT status, COUNT(*) FROM broadcast_deliveries WHERE broadcast_id=? GROUP BY status", (broadcast_id,)
+            )
+            return {status: count for status, count in await cur.fetchall()}
+
+    async def increment_stat(self, metric: str, bucket: str, delta: int = 1) -> None:
+        async def op(db: aiosqlite.Connection) -> None:
+            await db.execute(
+                """
+                INSERT INTO stats_counters (metric, bucket, value) VALUES (?, ?, ?)
+                ON CONFLICT(metric, bucket) DO UPDATE SET value = value + excluded.value
+                """,
+                (metric, bucket, delta),
+            )
+
+        await self._write(op)
+
+    async def get_stats(self, days: int = 7, top_skus: int = 5) -> dict[str, Any]:
+        """Read aggregates from the counter tables only (no scans of raw tables)."""
+        today = dt.datetime.utcnow().date()
+        first_day = (today - dt.timedelta(days=days - 1)).isoformat()
+        async with self._connect() as db:
+            cur = await db.execute("SELECT status, count FROM claim_counters WHERE count > 0 ORDER BY status")
+            claims_by_status = {status: count for status, count in await cur.fetchall()}
+
+            cur = await db.execute("SELECT value FROM stats_counters WHERE metric='warranties' AND bucket='total'")
+            row = await cur.fetchone()
+            warranties_total = row[0] if row else 0
+
+            cur = await db.execute(
+                "SELECT bucket, value FROM stats_counters WHERE metric='warranties_by_day' AND bucket >= ? ORDER BY bucket",
+                (first_day,),
+            )
+            warranties_by_day = {day: value for day, value in await cur.fetchall()}
+
+            cur = await db.execute(
+                "SELECT bucket, value FROM stats_counters WHERE metric='warranties_by_sku' AND value > 0 ORDER BY value DESC LIMIT ?",
+                (top_skus,),
+            )
+            top_sku = [(sku, value) for sku, value in await cur.fetchall()]
+
+            cur = await db.execute("SELECT bucket, value FROM stats_counters WHERE metric='scans'")
+            scans = {outcome: value for outcome, value in await cur.fetchall()}
+
+        return {
+            "claims_by_status": claims_by_status,
+            "warranties_total": warranties_total,
+            "warranties_by_day": warranties_by_day,
+            "top_skus": top_sku,
+            "scans": scans,
+        }
+
+    async def rebuild_stats(self, batch_size: int = 5000) -> None:
+        """Recompute claim and warranty counters from the raw tables.
+
+        The raw tables are counted into shadow tables in rowid batches, one
+        short write per batch. Meanwhile extra triggers apply the changes of
+        rows that are already counted, or were added after the rebuild started,
+        to the shadow tables as well; the last write swaps them in. Scan
+        counters have no raw data behind them and are kept as is.
+        """
+        async with self._stats_rebuild_lock:
+            await self._write(self._start_stats_rebuild)
+            batches = {
+                "claims": (
+                    """
+                    INSERT INTO claim_counters_rebuild (status, count)
+                    SELECT status, COUNT(*) FROM claims
+                    WHERE rowid > ? AND rowid <= ? AND status IS NOT NULL GROUP BY status
+                    ON CONFLICT(status) DO UPDATE SET count = count + excluded.count
+                    """,
+                ),
+                "claims_archive": (
+                    """
+                    INSERT INTO claim_counters_rebuild (status, count, archived)
+                    SELECT status, COUNT(*), COUNT(*) FROM claims_archive
+                    WHERE rowid > ? AND rowid <= ? AND status IS NOT NULL GROUP BY status
+                    ON CONFLICT(status) DO UPDATE SET count = count + excluded.count, archived = archived + excluded.archived
+                    """,
+                ),
+                "warranties": (
+                    """
+                    INSERT INTO stats_counters_rebuild (metric, bucket, value)
+                    SELECT 'warranties', 'total', COUNT(*) FROM warranties WHERE rowid > ? AND rowid <= ?
+                    ON CONFLICT(metric, bucket) DO UPDATE SET value = value + excluded.value
+                    """,
+                    """
+                    INSERT INTO stats_counters_rebuild (metric, bucket, value)
+                    SELECT 'warranties_by_day', COALESCE(substr(created_at, 1, 10), ''), COUNT(*)
+                    FROM warranties WHERE rowid > ? AND rowid <= ? GROUP BY 2
+                    ON CONFLICT(metric, bucket) DO UPDATE SET value = value + excluded.value
+                    """,
+                    """
+                    INSERT INTO stats_counters_rebuild (metric, bucket, value)
+                    SELECT 'warranties_by_sku', COALESCE(sku, ''), COUNT(*)
+                    FROM warranties WHERE rowid > ? AND rowid <= ? GROUP BY 2
+                    ON CONFLICT(metric, bucket) DO UPDATE SET value = value + excluded.value
+                    """,
+                ),
+            }
+            for source, queries in batches.items():
+
+                async def op(db: aiosqlite.Connection, source=source, queries=queries) -> bool:
+                    cur = await db.execute("SELECT scanned, boundary FROM stats_rebuild WHERE source=?", (source,))
+                    scanned, boundary = await cur.fetchone()
+                    cur = await db.execute(
+                        f"""
+                        SELECT MAX(rowid) FROM (
+                            SELECT rowid FROM {source} WHERE rowid > ? AND rowid <= ? ORDER BY rowid LIMIT ?
+                        )
+                        """,
+                        (scanned, boundary, batch_size),
+                    )
+                    upper = (await cur.fetchone())[0]
+                    if upper is None:
+                        return False
+                    for query in queries:
+                        await db.execute(query, (scanned, upper))
+                    # In the same transaction, so the triggers start counting these rows exactly now
+                    await db.execute("UPDATE stats_rebuild SET scanned=? WHERE source=?", (upper, source))
+                    return True
+
+                while await self._write(op):
+                    pass
+            await self._write(self._finish_stats_rebuild)
+
+    @staticmethod
+    async def _start_stats_rebuild(db: aiosqlite.Connection) -> None:
+        await Database._drop_stats_rebuild(db)
+        await db.execute(
+            """
+            CREATE TABLE claim_counters_rebuild (
+                status TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0,
+                archived INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        await db.execute(
+            """
+            CREATE TABLE stats_counters_rebuild (
+                metric TEXT NOT NULL,
+                bucket TEXT NOT NULL,
+                value INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (metric, bucket)
+            )
+            """
+        )
+        await db.execute("INSERT INTO stats_counters_rebuild (metric, bucket, value) VALUES ('warranties', 'total', 0)")
+        # Rows up to scanned are counted already, rows above boundary were added after the start
+        await db.execute(
+            "CREATE TABLE stats_rebuild (source TEXT PRIMARY KEY, scanned INTEGER NOT NULL, boundary INTEGER NOT NULL)"
+        )
+        for source in ("claims", "claims_archive", "warranties"):
+            await db.execute(
+                f"INSERT INTO stats_rebuild (source, scanned, boundary) SELECT ?, 0, COALESCE(MAX(rowid), 0) FROM {source}",
+                (source,),
+            )
+
+        def counted(source: str, row: str) -> str:
+            return f"(SELECT {row}.rowid <= scanned OR {row}.rowid > boundary FROM stats_rebuild WHERE source = '{source}')"
+
+        # Same as the claim_counters_* and stats_warranties_* triggers, on the shadow tables
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_claims_insert AFTER INSERT ON claims
+            WHEN {counted("claims", "NEW")}
+            BEGIN
+                INSERT INTO claim_counters_rebuild (status, count) VALUES (NEW.status, 1)
+                ON CONFLICT(status) DO UPDATE SET count = count + 1;
+            END
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_claims_update AFTER UPDATE OF status ON claims
+            WHEN OLD.status IS NOT NEW.status AND {counted("claims", "NEW")}
+            BEGIN
+                UPDATE claim_counters_rebuild SET count = count - 1 WHERE status = OLD.status;
+                INSERT INTO claim_counters_rebuild (status, count) VALUES (NEW.status, 1)
+                ON CONFLICT(status) DO UPDATE SET count = count + 1;
+            END
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_claims_delete AFTER DELETE ON claims
+            WHEN {counted("claims", "OLD")}
+            BEGIN
+                UPDATE claim_counters_rebuild SET count = count - 1 WHERE status = OLD.status;
+            END
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_claims_archive_insert AFTER INSERT ON claims_archive
+            WHEN {counted("claims_archive", "NEW")}
+            BEGIN
+                INSERT INTO claim_counters_rebuild (status, count, archived) VALUES (NEW.status, 1, 1)
+                ON CONFLICT(status) DO UPDATE SET count = count + 1, archived = archived + 1;
+            END
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_claims_archive_delete AFTER DELETE ON claims_archive
+            WHEN {counted("claims_archive", "OLD")}
+            BEGIN
+                UPDATE claim_counters_rebuild SET count = count - 1, archived = archived - 1 WHERE status = OLD.status;
+            END
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_warranties_insert AFTER INSERT ON warranties
+            WHEN {counted("warranties", "NEW")}
+            BEGIN
+                INSERT INTO stats_counters_rebuild (metric, bucket, value) VALUES ('warranties', 'total', 1)
+                ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+                INSERT INTO stats_counters_rebuild (metric, bucket, value)
+                VALUES ('warranties_by_day', COALESCE(substr(NEW.created_at, 1, 10), ''), 1)
+                ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+                INSERT INTO stats_counters_rebuild (metric, bucket, value)
+                VALUES ('warranties_by_sku', COALESCE(NEW.sku, ''), 1)
+                ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+            END
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_warranties_update AFTER UPDATE OF sku ON warranties
+            WHEN OLD.sku IS NOT NEW.sku AND {counted("warranties", "NEW")}
+            BEGIN
+                UPDATE stats_counters_rebuild SET value = value - 1
+                WHERE metric = 'warranties_by_sku' AND bucket = COALESCE(OLD.sku, '');
+                INSERT INTO stats_counters_rebuild (metric, bucket, value)
+                VALUES ('warranties_by_sku', COALESCE(NEW.sku, ''), 1)
+                ON CONFLICT(metric, bucket) DO UPDATE SET value = value + 1;
+            END
+            """
+        )
+        await db.execute(
+            f"""
+            CREATE TRIGGER stats_rebuild_warranties_delete AFTER DELETE ON warranties
+            WHEN {counted("warranties", "OLD")}
+            BEGIN
+                UPDATE stats_counters_rebuild SET value = value - 1 WHERE metric = 'warranties' AND bucket = 'total';
+                UPDATE stats_counters_rebuild SET value = value - 1
+                WHERE metric = 'warranties_by_day' AND bucket = COALESCE(substr(OLD.created_at, 1, 10), '');
+                UPDATE stats_counters_rebuild SET value = value - 1
+                WHERE metric = 'warranties_by_sku' AND bucket = COALESCE(OLD.sku, '');
+            END
+            """
+        )
+
+    @staticmethod
+    async def _finish_stats_rebuild(db: aiosqlite.Connection) -> None:
+        await db.execute("DELETE FROM claim_counters")
+        await db.execute(
+            "INSERT INTO claim_counters (status, count, archived) SELECT status, count, archived FROM claim_counters_rebuild"
+        )
+        await db.execute(
+            "DELETE FROM stats_counters WHERE metric IN ('warranties', 'warranties_by_day', 'warranties_by_sku')"
+        )
+        await db.execute(
+            "INSERT INTO stats_counters (metric, bucket, value) SELECT metric, bucket, value FROM stats_counters_rebuild"
+        )
+        await Database._drop_stats_rebuild(db)
+
+    @staticmethod
+    async def _drop_stats_rebuild(db: aiosqlite.Connection) -> None:
+        # Also cleans up after a rebuild that was interrupted by a restart
+        for table, name in (
+            ("claims", "insert"),
+            ("claims", "update"),
+            ("claims", "delete"),
+            ("claims_archive", "insert"),
+            ("claims_archive", "delete"),
+            ("warranties", "insert"),
+            ("warranties", "update"),
+            ("warranties", "delete"),
+        ):
+            await db.execute(f"DROP TRIGGER IF EXISTS stats_rebuild_{table}_{name}")
+        for table in ("claim_counters_rebuild", "stats_counters_rebuild", "stats_rebuild"):
+            await db.execute(f"DROP TABLE IF EXISTS {table}")
+
+    async def rebuild_search_index(self) -> None:
+        """Re-index all searchable text (first start, or after a full VACUUM renumbered rowids)."""
+        async def op(db: aiosqlite.Connection) -> None:
+            await db.execute("INSERT INTO claims_fts (claims_fts) VALUES ('rebuild')")
+            await db.execute("INSERT INTO claim_notes_fts (claim_notes_fts) VALUES ('rebuild')")
+            await db.execute("INSERT INTO warranties_fts (warranties_fts) VALUES ('rebuild')")
+            await db.execute("INSERT INTO claims_archive_fts (claims_archive_fts) VALUES ('rebuild')")
+            await db.execute("INSERT INTO claim_notes_archive_fts (claim_notes_archive_fts) VALUES ('rebuild')")
+
+        await self._write(op)
+
+    async def search(self, query: str, limit: int = 10, offset: int = 0) -> list[dict[str, Any]]:
+        """Ranked full-text search over claim descriptions, notes and receipt items, archived claims included.
+
+        Snippets wrap matches in char(2) ... char(3) so the caller can escape and highlight them.
+        """
+        terms = re.findall(r"\w+", query)
+        if not terms:
+            return []
+        # Quote every term so user input can't be parsed as FTS5 syntax
+        match = " ".join(f'"{term}"' for term in terms)
+        # Each source is ranked and cut on its own before merging
+        top = limit + offset
+        async with self._connect() as db:
+            db.row_factory = aiosqlite.Row
+            cur = await db.execute(
+                """
+                SELECT * FROM (
+                    SELECT 'claim' AS kind, c.id AS claim_id, c.tg_id, c.status, NULL AS warranty_id,
+                           snippet(claims_fts, 0, char(2), char(3), '…', 12) AS snippet,
+                           claims_fts.rank AS rank
+                    FROM claims_fts JOIN claims c ON c.rowid = claims_fts.rowid
+                    WHERE claims_fts MATCH ? ORDER BY claims_fts.rank LIMIT ?
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 'note', n.claim_id, c.tg_id, c.status, NULL,
+                           snippet(claim_notes_fts, 0, char(2), char(3), '…', 12),
+                           claim_notes_fts.rank
+                    FROM claim_notes_fts
+                    JOIN claim_notes n ON n.id = claim_notes_fts.rowid
+                    LEFT JOIN claims c ON c.id = n.claim_id
+                    WHERE claim_notes_fts MATCH ? ORDER BY claim_notes_fts.rank LIMIT ?
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 'claim', c.id, c.tg_id, c.status, NULL,
+                           snippet(claims_archive_fts, 0, char(2), char(3), '…', 12),
+                           claims_archive_fts.rank
+                    FROM claims_archive_fts JOIN claims_archive c ON c.rowid = claims_archive_fts.rowid
+                    WHERE claims_archive_fts MATCH ? ORDER BY claims_archive_fts.rank LIMIT ?
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 'note', n.claim_id, c.tg_id, c.status, NULL,
+                           snippet(claim_notes_archive_fts, 0, char(2), char(3), '…', 12),
+                           claim_notes_archive_fts.rank
+                    FROM claim_notes_archive_fts
+                    JOIN claim_notes_archive n ON n.id = claim_notes_archive_fts.rowid
+                    LEFT JOIN claims_archive c ON c.id = n.claim_id
+                    WHERE claim_notes_archive_fts MATCH ? ORDER BY claim_notes_archive_fts.rank LIMIT ?
+                )
+                UNION ALL
+                SELECT * FROM (
+                    SELECT 'warranty', NULL, w.tg_id, NULL, w.id,
+                           snippet(warranties_fts, -1, char(2), char(3), '…', 12),
+                           warranties_fts.rank
+                    FROM warranties_fts JOIN warranties w ON w.rowid = warranties_fts.rowid
+                    WHERE warranties_fts MATCH ? ORDER BY warranties_fts.rank LIMIT ?
+                )
+                ORDER BY rank LIMIT ? OFFSET ?
+                """,
+                (match, top, match, top, match, top, match, top, match, top, limit, offset),
+            )
+            rows = await cur.fetchall()
+            return [dict(row) for row in rows]
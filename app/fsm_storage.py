@@ -0,0 +1,150 @@
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from app.cache import LRUCache, MISSING
+from app.db import Database, to_epoch
+
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "3600"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1.0"))
+# Sessions untouched for this long are deleted
+FSM_TTL_DAYS = int(os.getenv("FSM_TTL_DAYS", "7"))
+FSM_PURGE_INTERVAL = int(os.getenv("FSM_PURGE_INTERVAL", "3600"))
+
+
+class _Session:
+    __slots__ = ("state", "data")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None) -> None:
+        self.state = state
+        self.data = data or {}
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage in the bot's SQLite database.
+
+    Sessions are kept in a bounded LRU cache. Changes are collected in memory
+    and written in one batch every ``flush_interval`` seconds, so a burst of
+    state changes costs a single transaction. Sessions that were not touched
+    for ``ttl_days`` are deleted.
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        cache_size: int = FSM_CACHE_SIZE,
+        cache_ttl: float = FSM_CACHE_TTL,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        ttl_days: int = FSM_TTL_DAYS,
+    ) -> None:
+        self.db = db
+        self.flush_interval = flush_interval
+        self.ttl_days = ttl_days
+        self._cache = LRUCache(cache_size, cache_ttl)
+        # Changed sessions waiting for the next flush
+        self._dirty: dict[str, _Session] = {}
+        self._task: asyncio.Task | None = None
+        self._purged_at: float | None = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        thread_id = "" if key.thread_id is None else key.thread_id
+        return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{thread_id}:{key.destiny}"
+
+    async def _session(self, key: str) -> _Session:
+        session = self._dirty.get(key) or self._cache.get(key)
+        if session is not MISSING and session is not None:
+            return session
+        row = await self.db.get_fsm_state(key)
+        # Another handler may have loaded or changed the session meanwhile
+        session = self._dirty.get(key) or self._cache.get(key)
+        if session is not MISSING and session is not None:
+            return session
+        if row:
+            state, data = row
+            session = _Session(state, json.loads(data) if data else {})
+        else:
+            session = _Session()
+        self._cache.set(key, session)
+        return session
+
+    def _mark_dirty(self, key: str, session: _Session) -> None:
+        self._dirty[key] = session
+        self._cache.set(key, session)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self._key(key)
+        session = await self._session(storage_key)
+        session.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(storage_key, session)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._session(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self._key(key)
+        session = await self._session(storage_key)
+        session.data = data.copy()
+        self._mark_dirty(storage_key, session)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._session(self._key(key))).data.copy()
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        items = [
+            (key, session.state, json.dumps(session.data, ensure_ascii=False, default=str) if session.data else None)
+            for key, session in dirty.items()
+        ]
+        try:
+            await self.db.save_fsm_states(items)
+        except BaseException:
+            # Keep the changes for the next flush unless they were changed again
+            for key, session in dirty.items():
+                self._dirty.setdefault(key, session)
+            raise
+
+    async def purge_expired(self) -> int:
+        older_than_ts = to_epoch(dt.datetime.utcnow()) - self.ttl_days * 86400
+        total = 0
+        while True:
+            removed = await self.db.purge_fsm_states(older_than_ts)
+            total += removed
+            if not removed:
+                break
+        if total:
+            logging.info(f"Removed {total} FSM sessions idle for more than {self.ttl_days} days")
+        return total
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if self._purged_at is None or time.monotonic() - self._purged_at >= FSM_PURGE_INTERVAL:
+                    self._purged_at = time.monotonic()
+                    await self.purge_expired()
+            except Exception as e:
+                logging.error(f"Failed to flush FSM states: {e}")
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -5,7 +5,9 @@ from aiogram.fsm.context import FSMContext
 from aiogram.filters import Command
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
+from app.broadcast import format_broadcast_stats, wake_broadcasts
 from app.database import db
+from app.instrumentation import snapshot
 from app.keyboards import admin_menu_kb, claims_list_kb, claim_status_kb
 from app.utils import ADMIN_CHAT_IDS, get_or_create_user_thread
 from app.states import AdminStates
@@ -65,30 +67,223 @@ async def admin_list_claims_handler(callback: CallbackQuery) -> None:
         await callback.answer("Недостаточно прав")
         return
     
-    parts = callback.data.split(":")
+    # admin:list_claims:<filter>[:next|prev:<created_ts>:<claim_id>]
+    parts = callback.data.split(":", 5)
     filter_type = parts[2] if len(parts) > 2 else "all"
-    page = int(parts[3]) if len(parts) > 3 else 0
+    direction = parts[3] if len(parts) > 5 else None
+    # The claim itself may be archived by now, so the cursor carries its sort key
+    cursor = (int(parts[4]), parts[5]) if len(parts) > 5 else None
     limit = 20
-    offset = page * limit
     
     group_id = await db.get_setting("admin_group_id")
     status_filter = "Новая" if filter_type == "new" else None
-    claims = await db.list_claims_with_threads(status=status_filter, limit=limit, offset=offset)
+    # Запрашиваем на одну заявку больше, чтобы понять, есть ли следующая страница
+    if direction == "prev":
+        claims = await db.list_claims_with_threads(status=status_filter, limit=limit + 1, before=cursor)
+        has_prev = len(claims) > limit
+        claims = claims[-limit:]
+        has_next = True
+    else:
+        claims = await db.list_claims_with_threads(status=status_filter, limit=limit + 1, after=cursor)
+        has_next = len(claims) > limit
+        claims = claims[:limit]
+        has_prev = cursor is not None
     total_count = await db.count_claims(status=status_filter)
     
     if not claims:
-        if page == 0:
+        if cursor is None:
             await callback.message.edit_text("Заявок не найдено.", reply_markup=admin_menu_kb())
         else:
             await callback.answer("Больше заявок нет.")
         return
 
     await callback.message.edit_text(
-        "Вот ваши заявки", 
-        reply_markup=claims_list_kb(claims, group_id, filter_type, page, total_count, limit)
+        f"Вот ваши заявки (всего: {total_count})", 
+        reply_markup=claims_list_kb(
+            claims,
+            group_id,
+            filter_type,
+            prev_cursor=f"{claims[0]['created_ts']}:{claims[0]['id']}" if has_prev else None,
+            next_cursor=f"{claims[-1]['created_ts']}:{claims[-1]['id']}" if has_next else None,
+        )
     )
     await callback.answer()
 
+@router.message(Command("stats"))
+async def stats_handler(message: Message) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+
+    stats = await db.get_stats()
+
+    claims_lines = "\n".join(
+        f"• {escape(status)}: {count}" for status, count in stats["claims_by_status"].items()
+    ) or "• нет заявок"
+    days_lines = "\n".join(
+        f"• {day}: {count}" for day, count in stats["warranties_by_day"].items()
+    ) or "• нет регистраций"
+    sku_lines = "\n".join(
+        f"• {escape(sku or 'Без артикула')}: {count}" for sku, count in stats["top_skus"]
+    ) or "• нет данных"
+
+    scans = stats["scans"]
+    scans_total = sum(scans.values())
+    if scans_total:
+        success_rate = scans.get("success", 0) / scans_total * 100
+        scans_text = (
+            f"Всего: {scans_total}, успешно: {scans.get('success', 0)} ({success_rate:.1f}%)\n"
+            f"Код не наш: {scans.get('not_ours', 0)}, не распознано: {scans.get('not_found', 0)}"
+        )
+    else:
+        scans_text = "Сканирований пока не было"
+
+    await message.answer(
+        "📊 <b>Статистика</b>\n\n"
+        f"<b>Заявки по статусам:</b>\n{claims_lines}\n\n"
+        f"<b>Гарантий всего:</b> {stats['warranties_total']}\n"
+        f"<b>Новые гарантии за 7 дней:</b>\n{days_lines}\n\n"
+        f"<b>Топ артикулов:</b>\n{sku_lines}\n\n"
+        f"<b>Распознавание ЧЗ:</b>\n{scans_text}",
+        parse_mode="HTML"
+    )
+
+@router.message(Command("stats_rebuild"))
+async def stats_rebuild_handler(message: Message) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+
+    await message.answer("⏳ Пересчитываю статистику...")
+    try:
+        await db.rebuild_stats()
+    except Exception as e:
+        logging.error(f"Failed to rebuild stats: {e}")
+        await message.answer(f"❌ Ошибка при пересчете статистики: {e}")
+        return
+    await message.answer("✅ Статистика пересчитана.")
+
+@router.message(Command("dbstats"))
+async def dbstats_handler(message: Message) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+
+    methods = snapshot()[:15]
+    if methods:
+        method_lines = "\n".join(
+            f"• <code>{escape(name.split('.')[-1])}</code>: {stats.calls} выз., "
+            f"ср. {stats.total / stats.calls * 1000 if stats.calls else 0:.1f} мс, "
+            f"p95 ≤ {stats.quantile(0.95) * 1000:.0f} мс, макс. {stats.max * 1000:.0f} мс, "
+            f"строк {stats.rows}, медл. {stats.slow}, ошибок {stats.errors}"
+            for name, stats in methods
+        )
+    else:
+        method_lines = "• нет данных (DB_METRICS выключен или обращений еще не было)"
+
+    cache_lines = "\n".join(
+        f"• {escape(name)}: {c['size']}/{c['maxsize']}, попаданий {c['hit_rate'] * 100:.1f}% "
+        f"({c['hits']}/{c['hits'] + c['misses']}), вытеснено {c['evictions']}"
+        for name, c in db.cache_stats().items()
+    )
+
+    outbox = await db.count_outbox()
+
+    await message.answer(
+        "🗄 <b>База данных</b>\n\n"
+        f"<b>Методы (по суммарному времени):</b>\n{method_lines}\n\n"
+        f"<b>Кэши:</b>\n{cache_lines}\n\n"
+        f"<b>Очередь уведомлений:</b> ожидают {outbox.get('pending', 0)}, не доставлены {outbox.get('failed', 0)}",
+        parse_mode="HTML"
+    )
+
+@router.message(Command("find_code"))
+async def find_code_handler(message: Message) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2 or len(parts[1].strip()) < 4:
+        await message.answer("Формат: /find_code <начало кода ЧЗ, от 4 символов>")
+        return
+
+    prefix = parts[1].strip()
+    warranties = await db.find_warranties_by_code_prefix(prefix, limit=10)
+    if not warranties:
+        await message.answer(f"Гарантии с кодом, начинающимся на <code>{escape(prefix)}</code>, не найдены.", parse_mode="HTML")
+        return
+
+    lines = [f"🔢 Гарантии по коду <code>{escape(prefix)}</code>:\n"]
+    for w in warranties:
+        lines.append(
+            f"📦 <b>{escape(w.get('sku') or 'Без артикула')}</b> — до {escape(w.get('end_date') or '-')}\n"
+            f"Код: <code>{escape(w['cz_code'])}</code>\n"
+            f"Пользователь: {w['tg_id']} @{escape(w.get('username') or '-')} ({escape(w.get('name') or '-')})\n"
+        )
+    if len(warranties) == 10:
+        lines.append("Показаны первые 10 совпадений, уточните код.")
+    await message.answer("\n".join(lines), parse_mode="HTML")
+
+SEARCH_PAGE_SIZE = 10
+
+async def render_search_page(query: str, page: int) -> tuple[str, InlineKeyboardMarkup]:
+    results = await db.search(query, limit=SEARCH_PAGE_SIZE + 1, offset=page * SEARCH_PAGE_SIZE)
+    has_next = len(results) > SEARCH_PAGE_SIZE
+    results = results[:SEARCH_PAGE_SIZE]
+
+    if not results:
+        return f"По запросу «{escape(query)}» ничего не найдено.", InlineKeyboardMarkup(inline_keyboard=[])
+
+    lines = [f"🔎 Результаты по запросу «{escape(query)}» (стр. {page + 1}):\n"]
+    rows = []
+    for item in results:
+        snippet = escape(item["snippet"] or "").replace("\x02", "<b>").replace("\x03", "</b>")
+        if item["kind"] == "warranty":
+            lines.append(f"📦 Гарантия {escape(item['warranty_id'])} (tg: {item['tg_id']})\n{snippet}\n")
+            continue
+        source = "заявка" if item["kind"] == "claim" else "переписка"
+        status = f", {escape(item['status'])}" if item.get("status") else ""
+        lines.append(f"🛠 Заявка {escape(item['claim_id'])} ({source}{status})\n{snippet}\n")
+        rows.append([InlineKeyboardButton(text=f"Заявка {item['claim_id']}", callback_data=f"claim:{item['claim_id']}")])
+
+    nav_row = []
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin:search:{page - 1}"))
+    if has_next:
+        nav_row.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"admin:search:{page + 1}"))
+    if nav_row:
+        rows.append(nav_row)
+
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=rows)
+
+@router.message(Command("search"))
+async def search_handler(message: Message, state: FSMContext) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer("Формат: /search <текст>")
+        return
+
+    query = parts[1]
+    # Запрос не помещается в callback_data, поэтому храним его в данных FSM
+    await state.update_data(search_query=query)
+    text, kb = await render_search_page(query, 0)
+    await message.answer(text, reply_markup=kb, parse_mode="HTML")
+
+@router.callback_query(F.data.startswith("admin:search:"))
+async def search_page_handler(callback: CallbackQuery, state: FSMContext) -> None:
+    if not ADMIN_CHAT_IDS or callback.from_user.id not in ADMIN_CHAT_IDS:
+        await callback.answer("Недостаточно прав")
+        return
+
+    data = await state.get_data()
+    query = data.get("search_query")
+    if not query:
+        await callback.answer("Поиск устарел, повторите /search")
+        return
+
+    page = int(callback.data.split(":")[2])
+    text, kb = await render_search_page(query, page)
+    await callback.message.edit_text(text, reply_markup=kb, parse_mode="HTML")
+    await callback.answer()
+
 @router.callback_query(F.data == "admin:menu")
 async def admin_menu_callback_handler(callback: CallbackQuery) -> None:
     if not ADMIN_CHAT_IDS or callback.from_user.id not in ADMIN_CHAT_IDS:
@@ -224,3 +419,79 @@ async def comment_handler(message: Message) -> None:
     await message.answer("Комментарий сохранен.")
     await message.bot.send_message(claim["tg_id"], f"Комментарий менеджера по заявке {claim_id}:\n{comment}")
 
+@router.message(Command("broadcast"))
+async def broadcast_handler(message: Message) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    if not message.reply_to_message:
+        await message.answer("Ответьте командой /broadcast на сообщение, которое нужно разослать всем владельцам гарантий.")
+        return
+
+    # The message is copied from this chat, so it must not be deleted until the broadcast is done
+    broadcast_id = await db.create_broadcast(message.chat.id, message.reply_to_message.message_id, message.from_user.id)
+    recipients = await db.count_broadcast_recipients()
+    kb = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="▶️ Запустить", callback_data=f"broadcast:start:{broadcast_id}"),
+        InlineKeyboardButton(text="Отмена", callback_data=f"broadcast:cancel:{broadcast_id}"),
+    ]])
+    await message.answer(
+        f"Рассылка #{broadcast_id}: сообщение получат {recipients} пользователей с гарантией. Запустить?",
+        reply_markup=kb,
+    )
+
+@router.callback_query(F.data.startswith("broadcast:"))
+async def broadcast_callback_handler(callback: CallbackQuery) -> None:
+    if not ADMIN_CHAT_IDS or callback.from_user.id not in ADMIN_CHAT_IDS:
+        await callback.answer("Недостаточно прав")
+        return
+    _, action, broadcast_id = callback.data.split(":", 2)
+    if action == "start":
+        changed = await db.set_broadcast_status(int(broadcast_id), "running", ("draft",))
+        text = f"Рассылка #{broadcast_id} запущена. Ход: /broadcast_status {broadcast_id}, пауза: /broadcast_pause {broadcast_id}"
+        wake_broadcasts()
+    else:
+        changed = await db.set_broadcast_status(int(broadcast_id), "cancelled", ("draft",))
+        text = f"Рассылка #{broadcast_id} отменена."
+    if not changed:
+        await callback.answer("Рассылка уже запущена или отменена")
+        return
+    await callback.message.edit_text(text)
+    await callback.answer()
+
+async def _broadcast_command(message: Message, status: str, from_statuses: tuple[str, ...], done_text: str) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].isdigit():
+        await message.answer(f"Формат: {parts[0]} <номер рассылки>")
+        return
+    if not await db.set_broadcast_status(int(parts[1]), status, from_statuses):
+        await message.answer("Рассылка не найдена или уже в этом состоянии.")
+        return
+    wake_broadcasts()
+    await message.answer(done_text.format(id=parts[1]))
+
+@router.message(Command("broadcast_pause"))
+async def broadcast_pause_handler(message: Message) -> None:
+    # The worker stops after the batch in progress
+    await _broadcast_command(message, "paused", ("running",), "Рассылка #{id} поставлена на паузу.")
+
+@router.message(Command("broadcast_resume"))
+async def broadcast_resume_handler(message: Message) -> None:
+    await _broadcast_command(message, "running", ("paused",), "Рассылка #{id} продолжена с места остановки.")
+
+@router.message(Command("broadcast_status"))
+async def broadcast_status_handler(message: Message) -> None:
+    if not ADMIN_CHAT_IDS or message.from_user.id not in ADMIN_CHAT_IDS:
+        return
+    parts = message.text.split()
+    if len(parts) > 1 and parts[1].isdigit():
+        broadcast = await db.get_broadcast(int(parts[1]))
+        broadcasts = [broadcast] if broadcast else []
+    else:
+        broadcasts = await db.list_broadcasts(limit=5)
+    if not broadcasts:
+        await message.answer("Рассылок нет.")
+        return
+    lines = [format_broadcast_stats(b, await db.get_broadcast_stats(b.id)) for b in broadcasts]
+    await message.answer("\n\n".join(lines))
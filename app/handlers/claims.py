@@ -13,15 +13,22 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
 from app.database import db
+from app.db import CZ_MIN_PREFIX, normalize_cz_code
 from app.states import ClaimStates
 from app.keyboards import (
     main_menu_kb, cancel_kb, purchase_type_kb, files_kb, 
     skip_kb, warranties_selection_kb, claim_status_kb
 )
-from app.utils import upsert_from_user, decode_image, format_decoded_codes, send_admin_claim, send_cached_photo
+from app.utils import upsert_from_user, decode_image, format_decoded_codes, send_cached_photo
+from app.outbox import wake_outbox
+from app.middlewares import MediaGroupMiddleware
 from app.receipt_parser import parse_receipt_pdf
 
 router = Router()
+# Albums reach handlers flagged with "album" as one call
+router.message.middleware(MediaGroupMiddleware())
+
+MAX_CLAIM_FILES = 5
 
 @router.message(F.text == "🛠 Обращение по изделию")
 @router.message(Command("claim"))
@@ -196,7 +203,7 @@ async def claim_cz_text_start_handler(callback: CallbackQuery, state: FSMContext
         "data/images/chz_code.png",
         "Введите код Честный знак вручную.\n\n"
         "Рядом с вашим ЧЗ есть буквенно цифровой код. Он начинается примерно так: 01046. "
-        "Введите ЦИФРОВУЮ часть этого кода - первые символы, обычно их от 12 до 20.",
+        f"Введите его первые {CZ_MIN_PREFIX} символов или больше: 01, 14 цифр, 21 и серийный номер.",
         reply_markup=cancel_kb()
     )
 
@@ -238,6 +245,9 @@ async def claim_purchase_cz_photo_handler(message: Message, state: FSMContext) -
         except Exception:
             pass
 
+    scan_outcome = "success" if codes and is_ours else "not_ours" if codes else "not_found"
+    await db.increment_stat("scans", scan_outcome)
+
     if not codes or not is_ours:
         failures += 1
         await state.update_data(cz_failures_claim=failures)
@@ -250,7 +260,7 @@ async def claim_purchase_cz_photo_handler(message: Message, state: FSMContext) -
                 message.chat.id,
                 "data/images/chz_code.png",
                 "⚠️ Не удалось распознать фото.\n\n"
-                "Введите ЦИФРОВУЮ часть кода ЧЗ вручную - первые символы, обычно их от 12 до 20.",
+                f"Введите код ЧЗ вручную - первые {CZ_MIN_PREFIX} символов или больше: 01, 14 цифр, 21 и серийный номер.",
                 reply_markup=cancel_kb()
             )
             return
@@ -304,6 +314,15 @@ async def claim_purchase_cz_text_handler(message: Message, state: FSMContext) ->
             )
             return
     
+    # Начало кода общее у всех изделий артикула, изделие определяет только серийный номер
+    if len(normalize_cz_code(cz_code)) < CZ_MIN_PREFIX:
+        await message.answer(
+            f"Код слишком короткий. Нужны первые {CZ_MIN_PREFIX} символов или больше: 01, 14 цифр, 21 и серийный номер.\n"
+            "Пожалуйста, проверьте и введите еще раз.",
+            reply_markup=cancel_kb()
+        )
+        return
+
     if await db.is_cz_registered(cz_code):
         await message.answer(
             "⚠️ Этот код Честный знак уже зарегистрирован в системе.\n"
@@ -313,10 +332,6 @@ async def claim_purchase_cz_text_handler(message: Message, state: FSMContext) ->
         await state.clear()
         return
 
-    if len(cz_code) < 10:
-        await message.answer("Код слишком короткий. Пожалуйста, проверьте и введите еще раз.", reply_markup=cancel_kb())
-        return
-
     await state.update_data(cz_code=cz_code, cz_file_id=None)
     user_data = await db.get_user(message.from_user.id)
     await start_next_claim_reg_step(message, state, user_data)
@@ -455,35 +470,37 @@ async def claim_description_handler(message: Message, state: FSMContext) -> None
         reply_markup=files_kb(),
     )
 
-@router.message(ClaimStates.files)
-async def claim_files_handler(message: Message, state: FSMContext) -> None:
-    data = await state.get_data()
-    files = data.get("files", [])
-
-    file_id = None
-    file_type = None
+def _message_file(message: Message) -> dict | None:
     if message.photo:
-        file_id = message.photo[-1].file_id
-        file_type = "photo"
-    elif message.video:
-        file_id = message.video.file_id
-        file_type = "video"
-    elif message.document:
-        file_id = message.document.file_id
-        file_type = "document"
-
-    if not file_id:
+        return {"file_id": message.photo[-1].file_id, "file_type": "photo"}
+    if message.video:
+        return {"file_id": message.video.file_id, "file_type": "video"}
+    if message.document:
+        return {"file_id": message.document.file_id, "file_type": "document"}
+    return None
+
+@router.message(ClaimStates.files, flags={"album": True})
+async def claim_files_handler(message: Message, state: FSMContext, album: list[Message] | None = None) -> None:
+    received = [item for item in map(_message_file, album or [message]) if item]
+    if not received:
         await message.answer("Отправьте фото/видео или нажмите “Готово”.")
         return
 
-    if len(files) >= 5:
+    data = await state.get_data()
+    files = data.get("files", [])
+    if len(files) >= MAX_CLAIM_FILES:
         await message.answer("Достигнут лимит 5 файлов. Нажмите “Готово”.")
         return
 
-    files.append({"file_id": file_id, "file_type": file_type})
+    # One state write for the whole album
+    accepted = received[:MAX_CLAIM_FILES - len(files)]
+    files.extend(accepted)
     await state.update_data(files=files)
-    if len(files) == 5:
-        await message.answer("Получено 5 файлов. Нажмите “Готово”.", reply_markup=files_kb())
+    if len(files) == MAX_CLAIM_FILES:
+        if len(accepted) < len(received):
+            await message.answer("Получено 5 файлов, остальные не добавлены. Нажмите “Готово”.", reply_markup=files_kb())
+        else:
+            await message.answer("Получено 5 файлов. Нажмите “Готово”.", reply_markup=files_kb())
 
 @router.callback_query(F.data == "files:done", ClaimStates.files)
 async def claim_files_done_handler(callback: CallbackQuery, state: FSMContext) -> None:
@@ -495,34 +512,21 @@ async def finalize_claim(message: Message, state: FSMContext, user: Any) -> None
     claim_number = await db.get_next_claim_number()
     claim_id = str(claim_number)
     
+    # Admins are notified by the outbox worker, the user doesn't wait for it
     await db.create_claim(
         claim_id=claim_id,
         tg_id=user.id,
         description=data["description"],
         purchase_type=data["purchase_type"],
         purchase_value=data["purchase_value"],
+        files=[(item["file_id"], item["file_type"]) for item in data.get("files", [])],
+        notify={
+            "username": user.username,
+            "receipt_items": data.get("receipt_items"),
+            "receipt_date": data.get("receipt_date"),
+        },
     )
-
-    for item in data.get("files", []):
-        await db.add_claim_file(claim_id, item["file_id"], item["file_type"])
-
-    user_db = await db.get_user(user.id)
-    claim = await db.get_claim(claim_id)
-    files = await db.get_claim_files(claim_id)
-    
-    # Send to admins/group
-    await send_admin_claim(
-        message.bot,
-        db,
-        claim,
-        files,
-        user.username,
-        user_db.get("name") if user_db else None,
-        user_db.get("phone") if user_db else None,
-        user_db.get("email") if user_db else None,
-        receipt_items=data.get("receipt_items"),
-        receipt_date=data.get("receipt_date"),
-    )
+    wake_outbox()
 
     await message.answer(
         f"Заявка принята! Номер: {claim_id}",
@@ -5,6 +5,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
 
 from app.database import db
+from app.records import ClaimRecord
 from app.utils import get_or_create_user_thread
 from app.constants import MAIN_MENU
 
@@ -13,8 +14,9 @@ router = Router()
 from aiogram.filters import StateFilter, Filter
 
 class HasActiveClaim(Filter):
-    async def __call__(self, message: Message) -> bool:
-        # Получаем последнюю заявку пользователя независимо от статуса
+    # Passes the active claim to the handler as "claim"
+    async def __call__(self, message: Message) -> bool | dict:
+        # Последняя заявка пользователя независимо от статуса (из кэша, без запроса к базе)
         last_claim = await db.get_last_claim(message.from_user.id)
         
         if not last_claim:
@@ -31,7 +33,7 @@ class HasActiveClaim(Filter):
         # Проверяем только активные статусы
         if status in ["Новая", "В работе", "Нужны уточнения"]:
             logging.debug(f"User {message.from_user.id} has active claim #{last_claim['id']} (status: {status})")
-            return True
+            return {"claim": last_claim}
         
         logging.debug(f"User {message.from_user.id} has claim #{last_claim['id']} with unknown status: {status}")
         return False
@@ -44,26 +46,9 @@ class HasActiveClaim(Filter):
     ~F.text.in_({"Отмена", "Готово", "Пропустить", "Чек WB", "Честный знак"}),
     HasActiveClaim()
 )
-async def attach_clarification(message: Message, bot: Bot, state: FSMContext) -> bool:
-    # Forward user message to admin thread if user has an active claim
-    claim = await db.get_last_claim(message.from_user.id)
-    
-    if not claim:
-        logging.debug(f"No claim found for user {message.from_user.id}, not forwarding")
-        return False
-    
+async def attach_clarification(message: Message, bot: Bot, state: FSMContext, claim: ClaimRecord) -> bool:
+    # Forward user message to admin thread; the claim comes from HasActiveClaim
     status = claim.get("status", "")
-    
-    # Проверяем, что заявка не закрыта
-    if status in ["Решено", "Закрыта"]:
-        logging.info(f"User {message.from_user.id} message not forwarded - claim #{claim['id']} is {status}")
-        return False
-    
-    # Проверяем, что заявка активна
-    if status not in ["Новая", "В работе", "Нужны уточнения"]:
-        logging.info(f"User {message.from_user.id} message not forwarded - claim #{claim['id']} has status: {status}")
-        return False
-    
     logging.info(f"Forwarding message from user {message.from_user.id} to admin thread (claim #{claim['id']}, status: {status})")
     group_id_str = await db.get_setting("admin_group_id")
     if not group_id_str:
@@ -11,6 +11,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
 from app.database import db
+from app.db import CZ_MIN_PREFIX, normalize_cz_code
 from app.states import WarrantyStates
 from app.keyboards import main_menu_kb, cancel_kb
 from app.utils import upsert_from_user, decode_image, send_cached_photo
@@ -75,7 +76,7 @@ async def warranty_cz_text_start_handler(callback: CallbackQuery, state: FSMCont
         "data/images/chz_code.png",
         "Введите код Честный знак вручную.\n\n"
         "Рядом с вашим ЧЗ есть буквенно цифровой код. Он начинается примерно так: 01046. "
-        "Введите ЦИФРОВУЮ часть этого кода - первые символы, обычно их от 12 до 20.",
+        f"Введите его первые {CZ_MIN_PREFIX} символов или больше: 01, 14 цифр, 21 и серийный номер.",
         reply_markup=cancel_kb()
     )
 
@@ -154,6 +155,9 @@ async def warranty_cz_handler(message: Message, state: FSMContext) -> None:
         except Exception:
             pass
 
+    scan_outcome = "success" if codes and is_ours else "not_ours" if codes else "not_found"
+    await db.increment_stat("scans", scan_outcome)
+
     if not codes or not is_ours:
         failures += 1
         await state.update_data(cz_failures=failures)
@@ -166,7 +170,7 @@ async def warranty_cz_handler(message: Message, state: FSMContext) -> None:
                 message.chat.id,
                 "data/images/chz_code.png",
                 "⚠️ Не удалось распознать фото.\n\n"
-                "Введите ЦИФРОВУЮ часть кода ЧЗ вручную - первые символы, обычно их от 12 до 20.",
+                f"Введите код ЧЗ вручную - первые {CZ_MIN_PREFIX} символов или больше: 01, 14 цифр, 21 и серийный номер.",
                 reply_markup=cancel_kb()
             )
             return
@@ -219,6 +223,15 @@ async def warranty_cz_text_handler(message: Message, state: FSMContext) -> None:
             )
             return
     
+    # Начало кода общее у всех изделий артикула, изделие определяет только серийный номер
+    if len(normalize_cz_code(cz_code)) < CZ_MIN_PREFIX:
+        await message.answer(
+            f"Код слишком короткий. Нужны первые {CZ_MIN_PREFIX} символов или больше: 01, 14 цифр, 21 и серийный номер.\n"
+            "Пожалуйста, проверьте и введите еще раз.",
+            reply_markup=cancel_kb()
+        )
+        return
+
     if await db.is_cz_registered(cz_code):
         await message.answer(
             "⚠️ Этот код Честный знак уже зарегистрирован в системе.\n"
@@ -227,10 +240,6 @@ async def warranty_cz_text_handler(message: Message, state: FSMContext) -> None:
         )
         return
 
-    if len(cz_code) < 10:
-        await message.answer("Код слишком короткий. Пожалуйста, проверьте и введите еще раз.", reply_markup=cancel_kb())
-        return
-
     await state.update_data(cz_code=cz_code, cz_file_id=None)
     user_data = await db.get_user(message.from_user.id)
     await start_next_registration_step(message, state, user_data)
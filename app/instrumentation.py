@@ -0,0 +1,128 @@
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import re
+import time
+from typing import Any, Callable
+
+DB_METRICS = os.getenv("DB_METRICS", "1") == "1"
+# Calls slower than this are logged with their SQL and query plans; 0 disables the log
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+
+# Upper bounds of latency buckets, seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float("inf"))
+
+# Literal values in SQL: blobs, strings (with '' escapes) and numbers
+_SQL_LITERAL_RE = re.compile(r"[xX]'[0-9a-fA-F]*'|'(?:[^']|'')*'|\b\d+(?:\.\d+)?(?:[eE][-+]?\d+)?\b")
+
+# SQL executed by the instrumented call currently running in this context
+current_statements: contextvars.ContextVar[list[str] | None] = contextvars.ContextVar("current_statements", default=None)
+
+
+class MethodStats:
+    __slots__ = ("calls", "errors", "total", "max", "rows", "buckets", "slow")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.slow = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def observe(self, elapsed: float, rows: int) -> None:
+        self.calls += 1
+        self.total += elapsed
+        self.rows += rows
+        if elapsed > self.max:
+            self.max = elapsed
+        for i, bound in enumerate(BUCKETS):
+            if elapsed <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile."""
+        if not self.calls:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+method_stats: dict[str, MethodStats] = {}
+
+# Lifecycle methods are not worth timing
+SKIP_METHODS = {"init", "close"}
+
+
+def count_rows(result: Any) -> int:
+    if result is None:
+        return 0
+    if isinstance(result, (list, tuple)):
+        return len(result)
+    return 1
+
+
+def instrument(cls: type) -> type:
+    """Wrap the public async methods of cls with timing and slow-call logging."""
+    if not DB_METRICS:
+        return cls
+    for name, func in list(vars(cls).items()):
+        if name.startswith("_") or name in SKIP_METHODS or not inspect.iscoroutinefunction(func):
+            continue
+        setattr(cls, name, _timed(f"{cls.__name__}.{name}", func))
+    return cls
+
+
+def _timed(name: str, func: Callable) -> Callable:
+    stats = method_stats.setdefault(name, MethodStats())
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        statements: list[str] | None = [] if DB_SLOW_QUERY_MS > 0 else None
+        token = current_statements.set(statements)
+        started = time.perf_counter()
+        try:
+            result = await func(self, *args, **kwargs)
+        except BaseException:
+            stats.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            current_statements.reset(token)
+        stats.observe(elapsed, count_rows(result))
+        if statements is not None and elapsed * 1000 >= DB_SLOW_QUERY_MS:
+            stats.slow += 1
+            self._log_slow_call(name, elapsed, statements)
+        return result
+
+    return wrapper
+
+
+def snapshot() -> list[tuple[str, MethodStats]]:
+    """Methods that were called at least once, slowest total time first."""
+    items = [(name, stats) for name, stats in method_stats.items() if stats.calls or stats.errors]
+    items.sort(key=lambda item: item[1].total, reverse=True)
+    return items
+
+
+def redact_sql(sql: str) -> str:
+    """Replace literals with ?; traced SQL has the bound values (names, phones, messages) filled in."""
+    return _SQL_LITERAL_RE.sub("?", sql)
+
+
+def log_slow_call(name: str, elapsed: float, plans: list[tuple[str, list[str]]]) -> None:
+    lines = [f"Slow DB call {name}: {elapsed * 1000:.1f} ms"]
+    for sql, plan in plans:
+        lines.append(f"  SQL: {' '.join(sql.split())}")
+        for step in plan:
+            lines.append(f"    {step}")
+    logging.warning("\n".join(lines))
@@ -1,5 +1,6 @@
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from app.constants import MAIN_MENU
+from app.records import ClaimRecord
 
 def main_menu_kb() -> InlineKeyboardMarkup:
     rows = [
@@ -82,7 +83,7 @@ def claim_status_kb(claim_id: str, status: str = "Новая", is_group: bool =
     
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def claims_list_kb(claims: list[dict], group_id: str | None = None, filter_type: str = "all", page: int = 0, total_count: int = 0, limit: int = 20) -> InlineKeyboardMarkup:
+def claims_list_kb(claims: list[ClaimRecord], group_id: str | None = None, filter_type: str = "all", prev_cursor: str | None = None, next_cursor: str | None = None) -> InlineKeyboardMarkup:
     rows = []
     for item in claims:
         status_icon = "🆕" if item['status'] == "Новая" else "🛠" if item['status'] == "В работе" else "🟢" if item['status'] == "Решено" else "❓"
@@ -104,11 +105,11 @@ def claims_list_kb(claims: list[dict], group_id: str | None = None, filter_type:
         rows.append(row)
     
     nav_row = []
-    if page > 0:
-        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin:list_claims:{filter_type}:{page-1}"))
+    if prev_cursor:
+        nav_row.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin:list_claims:{filter_type}:prev:{prev_cursor}"))
     
-    if (page + 1) * limit < total_count:
-        nav_row.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"admin:list_claims:{filter_type}:{page+1}"))
+    if next_cursor:
+        nav_row.append(InlineKeyboardButton(text="Вперед ➡️", callback_data=f"admin:list_claims:{filter_type}:next:{next_cursor}"))
     
     if nav_row:
         rows.append(nav_row)
@@ -3,29 +3,46 @@ import logging
 import os
 
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.base import BaseStorage
 
 from app.database import db
+from app.fsm_storage import SQLiteStorage
 from app.handlers import common, admin, warranty, claims, kb_admin, communication, unexpected
 from app.sheets import sheets_sync_scheduler
+from app.reminders import warranty_reminder_scheduler
+from app.archive import claims_archive_scheduler
+from app.maintenance import maintenance_scheduler
+from app.outbox import outbox_scheduler
+from app.broadcast import broadcast_scheduler
+from app.metrics import start_metrics_server
+from app.webhook import WEBHOOK_SECRET, run_webhook
+from app.sharding import SHARD_SOURCE, SHARD_WORKERS, run_sharded
+from app.ratelimit import RateLimitMiddleware, limiter
 
-async def main() -> None:
-    logging.basicConfig(level=logging.INFO)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Alternative Bot API server, e.g. a local one or scripts/fake_bot_api.py
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+
+
+def create_bot(rate_share: float = 1.0) -> Bot:
+    """rate_share is the part of the Telegram rate limits this process may use."""
     token = os.getenv("BOT_TOKEN")
     if not token:
         raise RuntimeError("BOT_TOKEN is required")
-
-    await db.init()
-    
-    # Проверяем сохраненную группу при старте
-    admin_group_id = await db.get_setting("admin_group_id")
-    if admin_group_id:
-        logging.info(f"Admin group ID loaded from database: {admin_group_id}")
+    if BOT_API_URL:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL))
     else:
-        logging.warning("Admin group ID not found in database. Use /add command in group to set it.")
+        session = AiohttpSession()
+    # Every outgoing message goes through the shared rate limiter
+    limiter.configure(rate_share)
+    session.middleware(RateLimitMiddleware(limiter))
+    return Bot(token=token, session=session)
+
 
-    bot = Bot(token=token)
-    dp = Dispatcher(storage=MemoryStorage())
+def build_dispatcher(storage: BaseStorage) -> Dispatcher:
+    dp = Dispatcher(storage=storage)
 
     # Order matters for AIogram 3.x routers
     
@@ -45,12 +62,67 @@ async def main() -> None:
     
     # 5. Unexpected/Catch-all (at the very end)
     dp.include_router(unexpected.router)
+    return dp
+
+
+async def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    # In webhook mode updates come from a public URL
+    uses_webhook = BOT_MODE == "webhook" or (BOT_MODE == "sharded" and SHARD_SOURCE == "webhook")
+    if uses_webhook and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET is required in webhook mode")
+    # Shard workers send through the same bot, the limits are split between the processes
+    bot = create_bot(rate_share=1 / (SHARD_WORKERS + 1) if BOT_MODE == "sharded" else 1.0)
 
+    await db.init()
+    
+    # Проверяем сохраненную группу при старте
+    admin_group_id = await db.get_setting("admin_group_id")
+    if admin_group_id:
+        logging.info(f"Admin group ID loaded from database: {admin_group_id}")
+    else:
+        logging.warning("Admin group ID not found in database. Use /add command in group to set it.")
+
+    # FSM sessions survive restarts
+    storage = SQLiteStorage(db)
+    dp = build_dispatcher(storage)
+
+    # Background jobs run only here, not in shard workers
     # Start Google Sheets sync in background
     asyncio.create_task(sheets_sync_scheduler())
 
-    logging.info("Bot started polling")
-    await dp.start_polling(bot)
+    # Warranty expiry reminders in background
+    asyncio.create_task(warranty_reminder_scheduler(bot))
+
+    # Move long-closed claims out of the hot tables
+    asyncio.create_task(claims_archive_scheduler())
+
+    # Admin notifications queued with the changes they report
+    asyncio.create_task(outbox_scheduler(bot))
+
+    # Admin broadcasts to warranty holders
+    asyncio.create_task(broadcast_scheduler(bot))
+
+    # Backups, orphan cleanup, incremental vacuum and planner statistics
+    asyncio.create_task(maintenance_scheduler())
+
+    # In webhook mode /metrics is served by the webhook server
+    metrics_runner = await start_metrics_server() if not uses_webhook else None
+
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        elif BOT_MODE == "sharded":
+            await run_sharded(bot, dp)
+        else:
+            logging.info("Bot started polling")
+            await dp.start_polling(bot)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await storage.close()
+        # Flush queued writes before exit
+        await db.close()
 
 if __name__ == "__main__":
     try:
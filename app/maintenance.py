@@ -0,0 +1,106 @@
+import asyncio
+import datetime as dt
+import glob
+import logging
+import os
+import time
+
+from app.database import DB_PATH, db
+from app.db import to_epoch
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", os.path.join(os.path.dirname(DB_PATH) or ".", "backups"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "86400"))
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+# Maintenance batches only start after this many seconds without writes
+MAINTENANCE_QUIET_SECONDS = float(os.getenv("MAINTENANCE_QUIET_SECONDS", "5"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "1000"))
+# Claim and user change log entries older than this are no longer needed by running processes
+CLAIM_CHANGES_KEEP_SECONDS = 86400
+
+
+async def wait_for_quiet() -> None:
+    while True:
+        idle = time.monotonic() - db.writer.last_write_at
+        if idle >= MAINTENANCE_QUIET_SECONDS:
+            return
+        await asyncio.sleep(MAINTENANCE_QUIET_SECONDS - idle)
+
+
+async def make_backup() -> str:
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    name = "data-" + dt.datetime.utcnow().strftime("%Y%m%d-%H%M%S") + ".db"
+    path = os.path.join(BACKUP_DIR, name)
+    tmp_path = path + ".tmp"
+    started = time.monotonic()
+    try:
+        await db.backup(tmp_path, pages=BACKUP_PAGES)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logging.info(f"Database backup saved to {path} in {time.monotonic() - started:.1f}s")
+
+    # Names sort by time, keep the newest BACKUP_KEEP
+    backups = sorted(glob.glob(os.path.join(BACKUP_DIR, "data-*.db")))
+    for old in backups[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+        os.remove(old)
+        logging.info(f"Removed old backup {old}")
+    return path
+
+
+async def run_maintenance() -> None:
+    removed = 0
+    while True:
+        await wait_for_quiet()
+        swept = await db.sweep_orphans(batch_size=MAINTENANCE_BATCH_SIZE)
+        removed += swept
+        if swept < MAINTENANCE_BATCH_SIZE:
+            break
+    if removed:
+        logging.info(f"Removed {removed} orphan claim files and notes")
+
+    older_than_ts = to_epoch(dt.datetime.utcnow()) - CLAIM_CHANGES_KEEP_SECONDS
+    while True:
+        await wait_for_quiet()
+        if await db.purge_claim_changes(older_than_ts, batch_size=MAINTENANCE_BATCH_SIZE) < MAINTENANCE_BATCH_SIZE:
+            break
+    while True:
+        await wait_for_quiet()
+        if await db.purge_user_changes(older_than_ts, batch_size=MAINTENANCE_BATCH_SIZE) < MAINTENANCE_BATCH_SIZE:
+            break
+
+    mode, free = await db.free_pages()
+    if mode == "incremental":
+        while free > 0:
+            await wait_for_quiet()
+            await db.incremental_vacuum(pages=MAINTENANCE_BATCH_SIZE)
+            _, left = await db.free_pages()
+            if left >= free:
+                break
+            free = left
+    elif free:
+        logging.info(f"{free} free pages not reclaimed: auto_vacuum is {mode}, needs a one-off VACUUM")
+
+    await wait_for_quiet()
+    await db.optimize()
+
+
+async def maintenance_scheduler():
+    logging.info(f"Starting maintenance scheduler (backups every {BACKUP_INTERVAL}s to {BACKUP_DIR}, maintenance every {MAINTENANCE_INTERVAL}s)")
+    last_backup: float | None = None
+    while True:
+        try:
+            await run_maintenance()
+        except Exception as e:
+            logging.error(f"Unexpected error in maintenance: {e}")
+
+        if last_backup is None or time.monotonic() - last_backup >= BACKUP_INTERVAL:
+            try:
+                await make_backup()
+                last_backup = time.monotonic()
+            except Exception as e:
+                logging.error(f"Database backup failed: {e}")
+
+        await asyncio.sleep(MAINTENANCE_INTERVAL)
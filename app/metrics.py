@@ -0,0 +1,58 @@
+import logging
+import os
+
+from aiohttp import web
+
+from app.database import db
+from app.instrumentation import BUCKETS, snapshot
+
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+# 0 disables the standalone metrics server
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+
+def render_metrics() -> str:
+    """Database metrics in the Prometheus text format."""
+    lines = ["# TYPE db_method_duration_seconds histogram"]
+    for name, stats in snapshot():
+        label = f'method="{name}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS, stats.buckets):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'db_method_duration_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+        lines.append(f"db_method_duration_seconds_sum{{{label}}} {stats.total}")
+        lines.append(f"db_method_duration_seconds_count{{{label}}} {stats.calls}")
+
+    for metric, attr in (("db_method_errors_total", "errors"), ("db_method_rows_total", "rows"), ("db_method_slow_total", "slow")):
+        lines.append(f"# TYPE {metric} counter")
+        for name, stats in snapshot():
+            lines.append(f'{metric}{{method="{name}"}} {getattr(stats, attr)}')
+
+    cache_stats = db.cache_stats()
+    for metric, key, kind in (
+        ("db_cache_size", "size", "gauge"),
+        ("db_cache_hits_total", "hits", "counter"),
+        ("db_cache_misses_total", "misses", "counter"),
+        ("db_cache_evictions_total", "evictions", "counter"),
+    ):
+        lines.append(f"# TYPE {metric} {kind}")
+        for cache, values in cache_stats.items():
+            lines.append(f'{metric}{{cache="{cache}"}} {values[key]}')
+    return "\n".join(lines) + "\n"
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain")
+
+
+async def start_metrics_server() -> web.AppRunner | None:
+    if not METRICS_PORT:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logging.info(f"Metrics available at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
@@ -0,0 +1,52 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import Message
+
+# How long to wait for the next part of an album before handling it
+MEDIA_GROUP_LATENCY = float(os.getenv("MEDIA_GROUP_LATENCY", "0.5"))
+
+
+class MediaGroupMiddleware(BaseMiddleware):
+    """Passes an album to handlers flagged with ``album`` as one call.
+
+    Telegram sends every photo of an album as a separate message. The first
+    one waits until no new part arrived for ``latency`` seconds, then the
+    handler runs once with ``album`` (all messages in order); the other
+    parts are swallowed. Messages outside albums get no ``album``.
+    """
+
+    def __init__(self, latency: float = MEDIA_GROUP_LATENCY) -> None:
+        self.latency = latency
+        self._albums: dict[tuple[int, str], list[Message]] = {}
+
+    async def __call__(
+        self,
+        handler: Callable[[Message, dict[str, Any]], Awaitable[Any]],
+        event: Message,
+        data: dict[str, Any],
+    ) -> Any:
+        if not event.media_group_id or not get_flag(data, "album"):
+            return await handler(event, data)
+
+        key = (event.chat.id, event.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(event)
+            return None
+
+        self._albums[key] = album = [event]
+        try:
+            received = 0
+            while received != len(album):
+                received = len(album)
+                await asyncio.sleep(self.latency)
+        finally:
+            del self._albums[key]
+
+        album.sort(key=lambda message: message.message_id)
+        data["album"] = album
+        return await handler(album[0], data)
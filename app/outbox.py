@@ -0,0 +1,168 @@
+import asyncio
+import datetime as dt
+import json
+import logging
+import os
+from typing import Any, Awaitable, Callable, Iterable
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from app.database import db
+from app.db import NEW_CLAIM_EVENT, to_epoch
+from app.records import OutboxRecord
+from app.utils import fan_out, send_admin_claim
+
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "1.0"))
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+# After this many failed attempts an entry is marked as failed and left in the table
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+# Retry delay doubles from OUTBOX_RETRY_BASE up to OUTBOX_RETRY_MAX seconds
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "5"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "3600"))
+
+# Set by handlers of this process after queueing, so delivery doesn't wait for the next poll
+_wakeup = asyncio.Event()
+
+
+def wake_outbox() -> None:
+    _wakeup.set()
+
+
+class Steps:
+    """Tracks which parts of a notification were already sent.
+
+    Every send has a key; keys that went out on an earlier attempt are
+    skipped, so a retry only sends what is missing.
+    """
+
+    def __init__(self, done: dict[str, bool] | None = None) -> None:
+        # key -> True if sent, False if dropped for good
+        self.done = dict(done or {})
+        self.errors: list[str] = []
+
+    def failed(self, key: str) -> bool:
+        """The send didn't go out (yet): callers may fall back to another way of delivery."""
+        return self.done.get(key) is not True
+
+    async def run(self, key: str, send: Callable[[], Awaitable[Any]]) -> Any:
+        if key in self.done:
+            return None
+        try:
+            result = await send()
+        except Exception as e:
+            result = e
+        return self._record(key, result)
+
+    async def fan_out(self, prefix: str, recipients: Iterable[int], send: Callable[[int], Awaitable[Any]]) -> None:
+        """run() for all recipients at once; the keys are prefix:recipient."""
+        pending = [recipient for recipient in recipients if f"{prefix}:{recipient}" not in self.done]
+        if not pending:
+            return
+        results = await fan_out(pending, send, label=f"Outbox {prefix}")
+        for recipient, result in results.items():
+            self._record(f"{prefix}:{recipient}", result)
+
+    def _record(self, key: str, result: Any) -> Any:
+        if isinstance(result, (TelegramForbiddenError, TelegramBadRequest)):
+            # Retrying won't help: the bot is blocked, the chat or topic is gone, no rights
+            logging.warning(f"Outbox step {key} dropped: {result}")
+            self.done[key] = False
+            return None
+        if isinstance(result, Exception):
+            logging.error(f"Outbox step {key} failed: {result}")
+            self.errors.append(f"{key}: {result}")
+            return None
+        self.done[key] = True
+        return result
+
+
+async def notify_new_claim(bot: Bot, payload: dict[str, Any], steps: Steps) -> None:
+    claim = await db.get_claim(payload["claim_id"])
+    if not claim:
+        logging.warning(f"Claim {payload['claim_id']} no longer exists, notification skipped")
+        return
+    files = await db.get_claim_files(claim["id"])
+    user = await db.get_user(claim["tg_id"])
+    await send_admin_claim(
+        bot,
+        db,
+        claim,
+        files,
+        payload.get("username"),
+        user.get("name") if user else None,
+        user.get("phone") if user else None,
+        user.get("email") if user else None,
+        receipt_items=payload.get("receipt_items"),
+        receipt_date=payload.get("receipt_date"),
+        steps=steps,
+    )
+
+
+HANDLERS: dict[str, Callable[[Bot, dict[str, Any], Steps], Awaitable[None]]] = {
+    NEW_CLAIM_EVENT: notify_new_claim,
+}
+
+
+async def _deliver(bot: Bot, entry: OutboxRecord, now_ts: int) -> bool:
+    """Deliver one entry and save the outcome; returns whether it is done."""
+    steps = Steps(json.loads(entry.done) if entry.done else None)
+    try:
+        handler = HANDLERS.get(entry.kind)
+        if handler is None:
+            raise ValueError(f"unknown outbox kind {entry.kind}")
+        await handler(bot, json.loads(entry.payload), steps)
+    except Exception as e:
+        logging.error(f"Failed to deliver outbox entry {entry.key}: {e}")
+        steps.errors.append(str(e))
+
+    # Saved as soon as the entry is handled, not with the whole batch: after a
+    # crash only the steps of entries still in progress can be sent again
+    if not steps.errors:
+        await db.finish_outbox([entry.id], [])
+        return True
+    attempts = entry.attempts + 1
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        status = "failed"
+        logging.error(f"Giving up on outbox entry {entry.key} after {attempts} attempts")
+    else:
+        status = "pending"
+    delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+    await db.finish_outbox([], [(
+        status, attempts, now_ts + int(delay), json.dumps(steps.done), "; ".join(steps.errors)[:1000], entry.id,
+    )])
+    return False
+
+
+async def deliver_outbox(bot: Bot) -> int:
+    """Deliver one batch of due entries; returns how many were taken."""
+    now_ts = to_epoch(dt.datetime.utcnow())
+    entries = await db.get_due_outbox(now_ts, limit=OUTBOX_BATCH_SIZE)
+    if not entries:
+        return 0
+
+    # The rate limiter paces the sends, entries are handled side by side
+    results = await asyncio.gather(*(_deliver(bot, entry, now_ts) for entry in entries))
+
+    delivered = sum(results)
+    if delivered < len(entries):
+        logging.warning(f"Outbox: {delivered} delivered, {len(entries) - delivered} to retry")
+    return len(entries)
+
+
+async def outbox_scheduler(bot: Bot):
+    logging.info(f"Starting outbox delivery (poll every {OUTBOX_POLL_INTERVAL}s, batch {OUTBOX_BATCH_SIZE})")
+    while True:
+        _wakeup.clear()
+        try:
+            taken = await deliver_outbox(bot)
+        except Exception as e:
+            logging.error(f"Unexpected error in outbox_scheduler: {e}")
+            taken = 0
+        if taken >= OUTBOX_BATCH_SIZE:
+            # More may be due right away
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMediaGroup
+from aiogram.methods.base import Response, TelegramMethod, TelegramType
+
+# Telegram limits: about 30 messages per second overall, 1 per second in a chat, 20 per minute in a group
+RATE_LIMIT_GLOBAL = float(os.getenv("RATE_LIMIT_GLOBAL", "30"))
+RATE_LIMIT_CHAT = float(os.getenv("RATE_LIMIT_CHAT", "1"))
+RATE_LIMIT_CHAT_BURST = int(os.getenv("RATE_LIMIT_CHAT_BURST", "3"))
+RATE_LIMIT_GROUP_PER_MINUTE = float(os.getenv("RATE_LIMIT_GROUP_PER_MINUTE", "20"))
+# How many times a request is repeated after RetryAfter before the error is raised
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "3"))
+
+# Per-chat buckets kept in memory; an idle bucket is full anyway, so dropping it loses nothing
+MAX_CHAT_BUCKETS = 10_000
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of refusing.
+
+    reserve() always takes a token and returns how long the caller has to
+    wait for it, so callers are served in the order they asked.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, now: float, cost: float = 1.0) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def block(self, now: float, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+
+def is_group(chat_id: Any) -> bool:
+    if isinstance(chat_id, str):
+        return chat_id.startswith("@") or chat_id.startswith("-")
+    return isinstance(chat_id, int) and chat_id < 0
+
+
+class RateLimiter:
+    """Global, per-chat and per-group limits for outgoing messages.
+
+    share scales the global and group rates when several processes send
+    through the same bot (sharded mode).
+    """
+
+    def __init__(self, share: float = 1.0) -> None:
+        self._named: dict[str, TokenBucket] = {}
+        self.configure(share)
+
+    def configure(self, share: float) -> None:
+        self._share = share
+        self.global_bucket = TokenBucket(RATE_LIMIT_GLOBAL * share, max(RATE_LIMIT_GLOBAL * share, 1.0))
+        self._chats: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+
+    def _chat_bucket(self, chat_id: Hashable) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if is_group(chat_id):
+                rate = RATE_LIMIT_GROUP_PER_MINUTE * self._share / 60
+                bucket = TokenBucket(rate, max(RATE_LIMIT_GROUP_PER_MINUTE * self._share, 1.0))
+            else:
+                bucket = TokenBucket(RATE_LIMIT_CHAT, RATE_LIMIT_CHAT_BURST)
+            self._chats[chat_id] = bucket
+            while len(self._chats) > MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def acquire(self, chat_id: Hashable | None, cost: float = 1.0) -> None:
+        now = time.monotonic()
+        delay = self.global_bucket.reserve(now, cost)
+        if chat_id is not None:
+            delay = max(delay, self._chat_bucket(chat_id).reserve(now, cost))
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def throttle(self, name: str, rate: float) -> None:
+        """Extra named limit on top of the Telegram ones, e.g. for bulk jobs."""
+        bucket = self._named.get(name)
+        if bucket is None or bucket.rate != rate:
+            bucket = self._named[name] = TokenBucket(rate, 1.0)
+        delay = bucket.reserve(time.monotonic())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def retry_after(self, chat_id: Hashable | None, seconds: float) -> None:
+        now = time.monotonic()
+        if chat_id is None:
+            self.global_bucket.block(now, seconds)
+        else:
+            self._chat_bucket(chat_id).block(now, seconds)
+
+
+# Methods that post messages into a chat
+LIMITED_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendDocument", "sendAudio", "sendVoice", "sendAnimation",
+    "sendVideoNote", "sendSticker", "sendLocation", "sendVenue", "sendContact", "sendPoll", "sendDice",
+    "sendMediaGroup", "copyMessage", "copyMessages", "forwardMessage", "forwardMessages",
+}
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Bot session middleware: every outgoing message waits for the limiter, RetryAfter is retried."""
+
+    def __init__(self, limiter: RateLimiter, max_retries: int = RATE_LIMIT_MAX_RETRIES) -> None:
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if method.__api_method__ not in LIMITED_METHODS:
+            return await make_request(bot, method)
+
+        chat_id = getattr(method, "chat_id", None)
+        # An album is one request but counts as a message per item
+        cost = len(method.media) if isinstance(method, SendMediaGroup) else 1
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id, cost)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Flood control on {method.__api_method__} to {chat_id}, retrying in {e.retry_after}s")
+                self.limiter.retry_after(chat_id, e.retry_after)
+
+
+# Shared by every bot session of this process
+limiter = RateLimiter()
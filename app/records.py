@@ -0,0 +1,91 @@
+from typing import Any, Iterator
+
+
+class Record:
+    """Row object with fixed attributes.
+
+    Much smaller than a dict per row. Supports the dict-style access
+    (``row["id"]``, ``row.get("sku")``) the handlers already use.
+    The first field is the primary key; records hash by it, so they can be
+    put in sets and used as dict keys.
+    """
+
+    __slots__ = ()
+
+    def __init__(self, *values: Any) -> None:
+        # Trailing fields missing from a query (e.g. joined columns) stay None
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+        for name in self.__slots__[len(values):]:
+            setattr(self, name, None)
+
+    @classmethod
+    def row_factory(cls, cursor: Any, row: tuple) -> "Record":
+        return cls(*row)
+
+    def __getitem__(self, key: str) -> Any:
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key) from None
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__slots__
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self) -> tuple[str, ...]:
+        return self.__slots__
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other: object) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __hash__(self) -> int:
+        # Equal records have equal keys, so this agrees with __eq__
+        return hash((type(self), getattr(self, self.__slots__[0])))
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class UserRecord(Record):
+    __slots__ = ("tg_id", "username", "name", "phone", "email", "thread_id", "created_at", "created_ts")
+
+
+class ClaimRecord(Record):
+    # thread_id comes from users in list_claims_with_threads
+    __slots__ = (
+        "id", "tg_id", "description", "purchase_type", "purchase_value", "status", "manager_comment",
+        "group_message_id", "created_at", "updated_at", "created_ts", "updated_ts", "thread_id",
+    )
+
+
+class ClaimFileRecord(Record):
+    __slots__ = ("id", "claim_id", "file_id", "file_type")
+
+
+class WarrantyRecord(Record):
+    # username, name and email come from users in joined queries
+    __slots__ = (
+        "id", "tg_id", "cz_code", "cz_file_id", "receipt_file_id", "sku", "receipt_date", "receipt_text",
+        "receipt_items", "start_date", "end_date", "created_at", "synced", "cz_key", "reminder_sent_ts",
+        "start_ts", "end_ts", "created_ts", "username", "name", "email",
+    )
+
+
+class OutboxRecord(Record):
+    __slots__ = ("id", "kind", "key", "payload", "status", "attempts", "next_attempt_ts", "done", "last_error", "created_ts")
+
+
+class BroadcastRecord(Record):
+    __slots__ = ("id", "from_chat_id", "message_id", "status", "cursor", "created_by", "created_ts", "finished_ts")
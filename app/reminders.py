@@ -0,0 +1,80 @@
+import asyncio
+import datetime as dt
+import logging
+import os
+from html import escape
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from app.database import db
+from app.db import to_epoch
+from app.ratelimit import limiter
+from app.records import WarrantyRecord
+
+REMINDER_WINDOW_DAYS = int(os.getenv("REMINDER_WINDOW_DAYS", "30"))
+REMINDER_INTERVAL = int(os.getenv("REMINDER_INTERVAL", "3600"))
+REMINDER_BATCH_SIZE = int(os.getenv("REMINDER_BATCH_SIZE", "500"))
+# Messages per second, leaves part of the global limit to interactive replies
+REMINDER_RATE = float(os.getenv("REMINDER_RATE", "20"))
+
+
+async def send_reminder(bot: Bot, warranty: WarrantyRecord) -> bool:
+    try:
+        end_date = dt.date.fromisoformat(warranty["end_date"]).strftime("%d.%m.%Y")
+    except (TypeError, ValueError):
+        end_date = warranty.get("end_date") or "-"
+
+    text = (
+        f"⏰ Гарантия на изделие <b>{escape(warranty.get('sku') or 'Изделие')}</b> "
+        f"заканчивается <b>{escape(end_date)}</b>.\n\n"
+        "Если с изделием что-то не так — оформите обращение, пока гарантия действует."
+    )
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🛠 Обращение по изделию", callback_data="menu:claim")]
+    ])
+
+    # Rate limits and RetryAfter are handled by the bot session middleware
+    try:
+        await bot.send_message(warranty["tg_id"], text, reply_markup=kb, parse_mode="HTML")
+        return True
+    except TelegramForbiddenError:
+        # Пользователь заблокировал бота
+        return False
+    except Exception as e:
+        logging.error(f"Failed to send warranty reminder {warranty['id']} to {warranty['tg_id']}: {e}")
+        return False
+
+
+async def send_warranty_reminders(bot: Bot) -> None:
+    now_ts = to_epoch(dt.datetime.utcnow())
+    to_ts = now_ts + REMINDER_WINDOW_DAYS * 86400
+
+    sent = 0
+    while True:
+        # Marked warranties drop out of the result, so every call returns the next batch
+        batch = await db.list_reminders_due(now_ts, to_ts, limit=REMINDER_BATCH_SIZE)
+        if not batch:
+            break
+
+        # Mark before sending: after a crash a reminder is skipped rather than sent twice
+        await db.mark_reminders_sent([w["id"] for w in batch])
+        for warranty in batch:
+            await limiter.throttle("reminders", REMINDER_RATE)
+            if await send_reminder(bot, warranty):
+                sent += 1
+
+    if sent:
+        logging.info(f"Sent {sent} warranty expiry reminders")
+
+
+async def warranty_reminder_scheduler(bot: Bot):
+    logging.info(f"Starting warranty reminder scheduler (window {REMINDER_WINDOW_DAYS} days, every {REMINDER_INTERVAL}s)")
+    while True:
+        try:
+            await send_warranty_reminders(bot)
+        except Exception as e:
+            logging.error(f"Unexpected error in warranty_reminder_scheduler: {e}")
+
+        await asyncio.sleep(REMINDER_INTERVAL)
@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import logging
+import multiprocessing as mp
+import os
+import signal
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+
+from app.webhook import run_webhook, wait_for_stop_signal
+
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 2)))
+# Where the front process gets updates from: polling or webhook
+SHARD_SOURCE = os.getenv("SHARD_SOURCE", "polling")
+# Updates of different chats processed at the same time by one worker
+SHARD_WORKER_CONCURRENCY = int(os.getenv("SHARD_WORKER_CONCURRENCY", "50"))
+SHARD_STOP_TIMEOUT = float(os.getenv("SHARD_STOP_TIMEOUT", "30"))
+
+
+def update_chat_id(update: dict[str, Any]) -> int:
+    """Chat an update belongs to; updates without a chat are keyed by the sender."""
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        sender = value.get("from") or value.get("user")
+        if sender:
+            return sender["id"]
+    return 0
+
+
+def shard_for(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+async def _process_updates(queue: mp.Queue, index: int) -> None:
+    # Imported here: worker processes are spawned and build their own bot and dispatcher
+    from app.database import db
+    from app.fsm_storage import SQLiteStorage
+    from app.main import build_dispatcher, create_bot
+
+    # The front process has run init() with the migrations already
+    await db.open()
+    bot = create_bot(rate_share=1 / (SHARD_WORKERS + 1))
+    storage = SQLiteStorage(db)
+    dp = build_dispatcher(storage)
+    semaphore = asyncio.Semaphore(SHARD_WORKER_CONCURRENCY)
+    # chat id -> [lock, updates holding or waiting for it]
+    chat_locks: dict[int, list] = {}
+    tasks: set[asyncio.Task] = set()
+
+    async def process(chat_id: int, update: dict[str, Any]) -> None:
+        entry = chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        # Parts of an album run side by side, MediaGroupMiddleware has to see them together
+        in_album = bool((update.get("message") or {}).get("media_group_id"))
+        try:
+            # Locks are FIFO, so updates of one chat run one by one in arrival order
+            async with contextlib.nullcontext() if in_album else entry[0], semaphore:
+                await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            logging.error(f"Worker {index} failed to process update {update.get('update_id')}: {e}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del chat_locks[chat_id]
+
+    loop = asyncio.get_running_loop()
+    logging.info(f"Shard worker {index} started (pid {os.getpid()})")
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    try:
+        while True:
+            item = await loop.run_in_executor(None, queue.get)
+            if item is None:
+                break
+            task = asyncio.create_task(process(*item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(set(tasks), timeout=SHARD_STOP_TIMEOUT)
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await storage.close()
+        await bot.session.close()
+        await db.close()
+        logging.info(f"Shard worker {index} stopped")
+
+
+def worker_main(queue: mp.Queue, index: int) -> None:
+    # The front process handles Ctrl+C and stops workers through the queue
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO, format=f"[worker {index}] %(levelname)s:%(name)s:%(message)s")
+    asyncio.run(_process_updates(queue, index))
+
+
+class ShardedDispatcher:
+    """Front side: routes raw updates to worker processes by chat id."""
+
+    def __init__(self, workers: int = SHARD_WORKERS) -> None:
+        self.workers = workers
+        self._ctx = mp.get_context("spawn")
+        self._queues: list[mp.Queue] = [self._ctx.Queue() for _ in range(workers)]
+        self._processes: list[mp.Process | None] = [None] * workers
+
+    def _spawn(self, index: int) -> None:
+        process = self._ctx.Process(target=worker_main, args=(self._queues[index], index), daemon=True)
+        process.start()
+        self._processes[index] = process
+
+    def start(self) -> None:
+        for index in range(self.workers):
+            self._spawn(index)
+        logging.info(f"Started {self.workers} shard workers")
+
+    async def feed(self, update: dict[str, Any]) -> None:
+        chat_id = update_chat_id(update)
+        index = shard_for(chat_id, self.workers)
+        process = self._processes[index]
+        if process is None or not process.is_alive():
+            # Queued updates are kept, the new worker picks them up
+            logging.error(f"Shard worker {index} is not running, restarting")
+            self._spawn(index)
+        self._queues[index].put_nowait((chat_id, update))
+
+    async def stop(self, timeout: float = SHARD_STOP_TIMEOUT) -> None:
+        for queue in self._queues:
+            queue.put_nowait(None)
+        loop = asyncio.get_running_loop()
+        for index, process in enumerate(self._processes):
+            if process is None:
+                continue
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning(f"Shard worker {index} did not stop in {timeout}s, terminating")
+                process.terminate()
+
+
+async def poll_updates(bot: Bot, feed, allowed_updates: list[str]) -> None:
+    """Long polling that hands raw updates to feed instead of a local dispatcher."""
+    offset = None
+    backoff = 1.0
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except Exception as e:
+            logging.error(f"Failed to fetch updates: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30.0)
+            continue
+        backoff = 1.0
+        for update in updates:
+            await feed(update.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = update.update_id + 1
+
+
+async def run_sharded(bot: Bot, dp: Dispatcher) -> None:
+    """Receive updates in this process and process them in SHARD_WORKERS processes.
+
+    dp is only used to know which update types the handlers need.
+    """
+    sharded = ShardedDispatcher()
+    sharded.start()
+    try:
+        if SHARD_SOURCE == "webhook":
+            await run_webhook(bot, dp, feed=sharded.feed)
+            return
+        logging.info("Bot started polling (sharded)")
+        polling = asyncio.create_task(poll_updates(bot, sharded.feed, dp.resolve_used_update_types()))
+        try:
+            await wait_for_stop_signal()
+        finally:
+            polling.cancel()
+            await asyncio.gather(polling, return_exceptions=True)
+            await bot.session.close()
+    finally:
+        await sharded.stop()
@@ -5,6 +5,9 @@ import gspread
 from google.oauth2.service_account import Credentials
 from app.database import db
 
+# Rows read from the DB and appended to the sheet per request
+SHEETS_BATCH_SIZE = int(os.getenv("SHEETS_BATCH_SIZE", "1000"))
+
 # Scopes for Google Sheets and Drive
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -36,9 +39,9 @@ async def sync_to_sheets():
         return
 
     try:
-        # Get unsynced data
-        unsynced = await db.get_unsynced_warranties()
-        if not unsynced:
+        batches = db.iter_unsynced_warranties(batch_size=SHEETS_BATCH_SIZE)
+        first_batch = await anext(batches, None)
+        if not first_batch:
             logging.info("No new warranties to sync to Google Sheets")
             return
 
@@ -50,40 +53,41 @@ async def sync_to_sheets():
             return
         sheet = worksheets[0]
         
-        # Проверяем, есть ли заголовки в первой строке
-        existing_data = await asyncio.to_thread(sheet.get_all_values)
+        # Проверяем, есть ли заголовки в первой строке (без загрузки всего листа)
+        first_row = await asyncio.to_thread(sheet.row_values, 1)
         headers = ["Email", "Username", "CZ Code", "Date", "SKU"]
         
-        # Проверяем первую строку
-        if not existing_data or len(existing_data) == 0:
+        if not first_row:
             # Таблица полностью пустая - добавляем заголовки
             logging.info("Sheet is empty, adding headers")
             await asyncio.to_thread(sheet.insert_row, headers, 1)
-        elif not existing_data[0] or existing_data[0] != headers:
+        elif first_row != headers:
             # Первая строка не содержит правильные заголовки - обновляем её
             logging.info("Updating headers in Google Sheets")
             await asyncio.to_thread(sheet.update, "A1:E1", [headers])
         
-        # Prepare rows
-        # Columns: Email, Username, CZ Code, Date, SKU
-        rows = []
-        warranty_ids = []
-        for w in unsynced:
-            rows.append([
-                w.get("email") or "-",
-                f"@{w.get('username')}" if w.get('username') else "-",
-                w.get("cz_code") or "-",
-                w.get("created_at") or "-",
-                w.get("sku") or "-"
-            ])
-            warranty_ids.append(w["id"])
+        total = 0
+        batch = first_batch
+        while batch:
+            # Columns: Email, Username, CZ Code, Date, SKU
+            rows = [
+                [
+                    w.email or "-",
+                    f"@{w.username}" if w.username else "-",
+                    w.cz_code or "-",
+                    w.created_at or "-",
+                    w.sku or "-",
+                ]
+                for w in batch
+            ]
 
-        # Append rows to sheet
-        await asyncio.to_thread(sheet.append_rows, rows)
-        
-        # Mark as synced in DB
-        await db.mark_as_synced(warranty_ids)
-        logging.info(f"Successfully synced {len(rows)} warranties to Google Sheets")
+            # Append rows to sheet, then mark this batch as synced in DB
+            await asyncio.to_thread(sheet.append_rows, rows)
+            await db.mark_as_synced([w.id for w in batch])
+            total += len(rows)
+            batch = await anext(batches, None)
+
+        logging.info(f"Successfully synced {total} warranties to Google Sheets")
         
     except Exception as e:
         logging.error(f"Error during Google Sheets sync: {e}")
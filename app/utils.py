@@ -3,8 +3,10 @@ import json
 import logging
 import os
 from html import escape
+from typing import Any, Awaitable, Callable, Iterable
+
 from aiogram import Bot
-from aiogram.types import FSInputFile
+from aiogram.types import FSInputFile, InputMediaDocument, InputMediaPhoto, InputMediaVideo
 from app.scanner import extract_datamatrix
 from app.constants import CARE_TEXT, TRUST_TEXT
 
@@ -16,6 +18,16 @@ TG_CHANNEL_URL = os.getenv("TG_CHANNEL_URL", "https://t.me/your_channel")
 CERTS_URL = os.getenv("CERTS_URL", "https://example.com/certs")
 FAQ_URL = os.getenv("FAQ_URL", "https://example.com/faq")
 
+# Telegram allows 2-10 items in one media group
+MEDIA_GROUP_LIMIT = 10
+MEDIA_TYPES = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
+
+# Sends to different recipients running at the same time in fan_out
+FAN_OUT_CONCURRENCY = int(os.getenv("FAN_OUT_CONCURRENCY", "10"))
+
+# user id -> [lock, callers holding or waiting for it]
+_thread_locks: dict[int, list] = {}
+
 ADMIN_CHAT_IDS_RAW = os.getenv("ADMIN_CHAT_IDS", "")
 ADMIN_CHAT_IDS = [
     int(item.strip())
@@ -109,32 +121,57 @@ async def send_cached_photo(bot: Bot, db, chat_id: int, photo_path: str, caption
         await bot.send_message(chat_id, caption, reply_markup=reply_markup, parse_mode=parse_mode)
 
 async def get_or_create_user_thread(bot: Bot, db, user_id: int) -> int | None:
-    user = await db.get_user(user_id)
-    if not user:
-        return None
-    
+    thread_id = await db.get_user_thread(user_id)
+    if thread_id:
+        return thread_id
+
     group_id_str = await db.get_setting("admin_group_id")
     if not group_id_str:
         return None
     
     group_id = int(group_id_str)
-    
-    if user.get("thread_id"):
-        return user["thread_id"]
-    
+
+    # One topic per user: concurrent calls of this process wait for the first one
+    # to create it, other processes are sorted out by claim_user_thread below
+    entry = _thread_locks.setdefault(user_id, [asyncio.Lock(), 0])
+    entry[1] += 1
     try:
-        topic_name = f"{user.get('name') or user.get('username') or user_id} ({user_id})"
-        forum_topic = await bot.create_forum_topic(group_id, topic_name)
-        thread_id = forum_topic.message_thread_id
-        await db.update_user_thread(user_id, thread_id)
-        return thread_id
-    except Exception as e:
-        logging.error(f"Failed to create forum topic: {e}")
-        return None
+        async with entry[0]:
+            thread_id = await db.get_user_thread(user_id)
+            if thread_id:
+                return thread_id
+
+            user = await db.get_user(user_id)
+            if not user:
+                return None
+
+            try:
+                topic_name = f"{user.get('name') or user.get('username') or user_id} ({user_id})"
+                forum_topic = await bot.create_forum_topic(group_id, topic_name)
+                thread_id = forum_topic.message_thread_id
+            except Exception as e:
+                logging.error(f"Failed to create forum topic: {e}")
+                return None
+
+            winner = await db.claim_user_thread(user_id, thread_id)
+            if winner != thread_id:
+                # Another process saved its topic first: drop ours and use that one
+                logging.info(f"Topic {winner} for user {user_id} was created elsewhere, deleting duplicate {thread_id}")
+                try:
+                    await bot.delete_forum_topic(group_id, thread_id)
+                except Exception as e:
+                    logging.error(f"Failed to delete duplicate forum topic {thread_id}: {e}")
+            return winner
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _thread_locks[user_id]
 
 async def send_admin_claim(
-    bot: Bot, db, claim: dict, files: list[dict], username: str | None, name: str | None, phone: str | None, email: str | None = None, receipt_items: str | None = None, receipt_date: str | None = None
+    bot: Bot, db, claim: dict, files: list[dict], username: str | None, name: str | None, phone: str | None, email: str | None = None, receipt_items: str | None = None, receipt_date: str | None = None, *, steps
 ) -> None:
+    """Called by the outbox worker; every send goes through steps (app.outbox.Steps),
+    so a retry skips what already went out."""
     from app.keyboards import claim_status_kb
 
     # Используем переданные данные чека, если есть, иначе пытаемся найти в гарантии
@@ -168,29 +205,20 @@ async def send_admin_claim(
             f"{receipt_date_info}{products_info}\n"
             f"текст: {escape(claim['description'])}\n"
         )
-        for admin_id in ADMIN_CHAT_IDS:
-            try:
-                await bot.send_message(admin_id, text, reply_markup=claim_status_kb(claim["id"]), parse_mode="HTML")
-                # Задержка между отправками, чтобы избежать flood control
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                logging.error(f"Failed to send message to admin {admin_id}: {e}")
-
-        if files:
-            for index, item in enumerate(files):
-                caption = f"Файлы по заявке {claim['id']}" if index == 0 else None
-                for admin_id in ADMIN_CHAT_IDS:
-                    try:
-                        if item["file_type"] == "photo":
-                            await bot.send_photo(admin_id, item["file_id"], caption=caption)
-                        elif item["file_type"] == "video":
-                            await bot.send_video(admin_id, item["file_id"], caption=caption)
-                        else:
-                            await bot.send_document(admin_id, item["file_id"], caption=caption)
-                        # Задержка между отправками файлов
-                        await asyncio.sleep(0.1)
-                    except Exception as e:
-                        logging.error(f"Failed to send file to admin {admin_id}: {e}")
+        await steps.fan_out(
+            "admin",
+            ADMIN_CHAT_IDS,
+            lambda admin_id: bot.send_message(admin_id, text, reply_markup=claim_status_kb(claim["id"]), parse_mode="HTML"),
+        )
+
+        # Albums go out in order, each one to all admins at once
+        for index, album in enumerate(build_albums(files)):
+            caption = f"Файлы по заявке {claim['id']}" if index == 0 else None
+            await steps.fan_out(
+                f"album:{index}",
+                ADMIN_CHAT_IDS,
+                lambda admin_id, album=album, caption=caption: send_album(bot, admin_id, album, caption=caption),
+            )
         return
 
     group_id = int(group_id_str)
@@ -214,66 +242,111 @@ async def send_admin_claim(
         f"{receipt_date_info}{products_info}\n"
         f"<b>Текст проблемы:</b>\n{escape(claim['description'])}"
     )
-    
-    try:
-        send_kwargs = {
-            "chat_id": group_id,
-            "text": text,
-            "reply_markup": claim_status_kb(claim["id"], is_group=True),
-            "parse_mode": "HTML"
-        }
-        if thread_id:
-            send_kwargs["message_thread_id"] = thread_id
-        
+
+    send_kwargs = {
+        "chat_id": group_id,
+        "text": text,
+        "reply_markup": claim_status_kb(claim["id"], is_group=True),
+        "parse_mode": "HTML"
+    }
+    if thread_id:
+        send_kwargs["message_thread_id"] = thread_id
+
+    async def post_to_group() -> int:
         group_msg = await bot.send_message(**send_kwargs)
-        logging.info(f"Successfully sent claim {claim['id']} to group {group_id}, message_id: {group_msg.message_id}")
-        
-        try:
-            await bot.pin_chat_message(group_id, group_msg.message_id)
-        except Exception as e:
-            logging.warning(f"Failed to pin message in group: {e}")
-        
         await db.update_claim_group_message(claim["id"], group_msg.message_id)
-        
-        clean_group_id = group_id_str.replace("-100", "")
-        msg_link = f"https://t.me/c/{clean_group_id}/{group_msg.message_id}"
-        
-        private_text = (
-            f"🛠 <b>Новая заявка {escape(claim['id'])}</b>\n"
-            f"Пользователь: @{escape(username or '-')}\n"
-            f"Ссылка: {msg_link}"
-        )
-        
-        for admin_id in ADMIN_CHAT_IDS:
-            try:
-                await bot.send_message(admin_id, private_text, reply_markup=claim_status_kb(claim["id"], is_group=False, group_link=msg_link), parse_mode="HTML")
-                # Задержка между отправками, чтобы избежать flood control
-                await asyncio.sleep(0.1)
-            except Exception as e:
-                logging.error(f"Failed to send notification to admin {admin_id}: {e}")
+        logging.info(f"Successfully sent claim {claim['id']} to group {group_id}, message_id: {group_msg.message_id}")
+        return group_msg.message_id
+
+    # Posted on an earlier attempt: the message id is already saved with the claim
+    group_message_id = claim.get("group_message_id") or await steps.run("group", post_to_group)
+    if not group_message_id:
+        if steps.failed("group"):
+            logging.error(f"Failed to send claim {claim['id']} to group {group_id}")
+            # Пытаемся отправить админам напрямую, сразу после первой неудачи;
+            # пост в группу повторяется при следующих попытках
+            await steps.fan_out(
+                "fallback",
+                ADMIN_CHAT_IDS,
+                lambda admin_id: bot.send_message(admin_id, text, reply_markup=claim_status_kb(claim["id"], is_group=False), parse_mode="HTML"),
+            )
+        return
+
+    await steps.run("pin", lambda: bot.pin_chat_message(group_id, group_message_id))
+
+    clean_group_id = group_id_str.replace("-100", "")
+    msg_link = f"https://t.me/c/{clean_group_id}/{group_message_id}"
+    
+    private_text = (
+        f"🛠 <b>Новая заявка {escape(claim['id'])}</b>\n"
+        f"Пользователь: @{escape(username or '-')}\n"
+        f"Ссылка: {msg_link}"
+    )
+    
+    await steps.fan_out(
+        "link",
+        ADMIN_CHAT_IDS,
+        lambda admin_id: bot.send_message(admin_id, private_text, reply_markup=claim_status_kb(claim["id"], is_group=False, group_link=msg_link), parse_mode="HTML"),
+    )
+
+    for index, album in enumerate(build_albums(files)):
+        await steps.run(f"album:{index}", lambda album=album: send_album(bot, group_id, album, message_thread_id=thread_id))
+
+
+async def fan_out(
+    recipients: Iterable[int],
+    send: Callable[[int], Awaitable[Any]],
+    label: str,
+    concurrency: int = FAN_OUT_CONCURRENCY,
+) -> dict[int, Any]:
+    """Run send for all recipients concurrently, at most ``concurrency`` at a time.
+
+    Returns recipient -> result, or the exception send raised; a single
+    summary line is logged. Pacing is left to the bot's rate limiter.
+    """
+    recipients = list(dict.fromkeys(recipients))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_one(recipient: int) -> Any:
+        async with semaphore:
+            return await send(recipient)
+
+    results = await asyncio.gather(*(send_one(recipient) for recipient in recipients), return_exceptions=True)
+    outcome = dict(zip(recipients, results))
+    failed = {recipient: result for recipient, result in outcome.items() if isinstance(result, Exception)}
+    if failed:
+        errors = ", ".join(f"{recipient}: {error}" for recipient, error in failed.items())
+        logging.warning(f"{label}: delivered {len(recipients) - len(failed)}/{len(recipients)}, failed {errors}")
+    elif recipients:
+        logging.info(f"{label}: delivered {len(recipients)}/{len(recipients)}")
+    return outcome
+
+
+async def send_file(bot: Bot, chat_id: int, item: dict, **kwargs):
+    if item["file_type"] == "photo":
+        return await bot.send_photo(chat_id, item["file_id"], **kwargs)
+    if item["file_type"] == "video":
+        return await bot.send_video(chat_id, item["file_id"], **kwargs)
+    return await bot.send_document(chat_id, item["file_id"], **kwargs)
+
+
+def build_albums(files: list[dict]) -> list[list[dict]]:
+    """Photos and videos go together, documents separately, at most MEDIA_GROUP_LIMIT per album."""
+    media = [item for item in files if item["file_type"] in ("photo", "video")]
+    documents = [item for item in files if item["file_type"] not in ("photo", "video")]
+    return [
+        items[start:start + MEDIA_GROUP_LIMIT]
+        for items in (media, documents)
+        for start in range(0, len(items), MEDIA_GROUP_LIMIT)
+    ]
 
-        if files:
-            for item in files:
-                try:
-                    if item["file_type"] == "photo":
-                        await bot.send_photo(group_id, item["file_id"], message_thread_id=thread_id)
-                    elif item["file_type"] == "video":
-                        await bot.send_video(group_id, item["file_id"], message_thread_id=thread_id)
-                    else:
-                        await bot.send_document(group_id, item["file_id"], message_thread_id=thread_id)
-                    # Задержка между отправками файлов
-                    await asyncio.sleep(0.1)
-                except Exception as e:
-                    logging.error(f"Failed to send file to group thread: {e}")
-                    
-    except Exception as e:
-        logging.error(f"Failed to send claim {claim['id']} to group {group_id}: {e}")
-        # Пытаемся отправить админам напрямую
-        for admin_id in ADMIN_CHAT_IDS:
-            try:
-                await bot.send_message(admin_id, text, reply_markup=claim_status_kb(claim["id"], is_group=False), parse_mode="HTML")
-                # Задержка между отправками, чтобы избежать flood control
-                await asyncio.sleep(0.1)
-            except Exception as admin_err:
-                logging.error(f"Failed to send claim to admin {admin_id}: {admin_err}")
 
+async def send_album(bot: Bot, chat_id: int, items: list[dict], caption: str | None = None, **kwargs):
+    # An album needs at least two items
+    if len(items) == 1:
+        return await send_file(bot, chat_id, items[0], caption=caption, **kwargs)
+    media = []
+    for index, item in enumerate(items):
+        media_type = MEDIA_TYPES.get(item["file_type"], InputMediaDocument)
+        media.append(media_type(media=item["file_id"], caption=caption if index == 0 else None))
+    return await bot.send_media_group(chat_id, media, **kwargs)
@@ -0,0 +1,151 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+
+from app.metrics import metrics_handler
+
+# Public base URL Telegram should call, e.g. https://bot.example.com; empty - don't register the webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Required: without it anyone who knows the URL could post fake updates
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+# Updates processed at the same time; further requests wait for a free slot
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "100"))
+# How long shutdown waits for updates that are still being processed
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+FeedUpdate = Callable[[dict[str, Any]], Awaitable[Any]]
+
+
+class WebhookServer:
+    """Receives updates over HTTP and hands them to ``feed``.
+
+    Telegram gets its 200 as soon as an update is accepted; processing runs
+    in the background, at most ``max_concurrency`` updates at a time.
+    """
+
+    def __init__(
+        self,
+        feed: FeedUpdate,
+        path: str = WEBHOOK_PATH,
+        secret: str = WEBHOOK_SECRET,
+        max_concurrency: int = WEBHOOK_MAX_CONCURRENCY,
+    ) -> None:
+        if not secret:
+            raise RuntimeError("WEBHOOK_SECRET is required in webhook mode")
+        self.feed = feed
+        self.path = path
+        self.secret = secret
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._tasks: set[asyncio.Task] = set()
+        self._closing = False
+        self._runner: web.AppRunner | None = None
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get("/metrics", metrics_handler)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            return web.Response(status=401)
+        if self._closing:
+            # Telegram retries later, possibly on another instance
+            return web.Response(status=503)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        await self._semaphore.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: dict[str, Any]) -> None:
+        try:
+            await self.feed(update)
+        except Exception as e:
+            logging.error(f"Failed to process update {update.get('update_id')}: {e}")
+        finally:
+            self._semaphore.release()
+
+    async def start(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT) -> None:
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logging.info(f"Webhook server listening on {host}:{port}{self.path}")
+
+    async def stop(self, drain_timeout: float = WEBHOOK_DRAIN_TIMEOUT) -> None:
+        """Stop taking updates, wait for the ones in progress, then close the server."""
+        self._closing = True
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + drain_timeout
+        # Requests that were waiting for a slot may still add tasks while draining
+        while self._tasks and loop.time() < deadline:
+            logging.info(f"Waiting for {len(self._tasks)} updates to finish")
+            await asyncio.wait(set(self._tasks), timeout=deadline - loop.time())
+        if self._tasks:
+            logging.warning(f"{len(self._tasks)} updates still running after {drain_timeout}s, cancelling")
+            pending = set(self._tasks)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+async def wait_for_stop_signal() -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, feed: FeedUpdate | None = None) -> None:
+    """Serve updates over a webhook until SIGINT/SIGTERM.
+
+    ``feed`` defaults to processing updates with ``dp`` in this process.
+    """
+    if feed is None:
+        async def feed(update: dict[str, Any]) -> None:
+            await dp.feed_raw_update(bot, update)
+
+    server = WebhookServer(feed)
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    await server.start()
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info(f"Webhook registered at {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+    else:
+        logging.warning("WEBHOOK_URL is not set, webhook is not registered with Telegram")
+
+    try:
+        await wait_for_stop_signal()
+    finally:
+        logging.info("Stopping webhook server")
+        await server.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
@@ -0,0 +1,144 @@
+"""Minimal stand-in for the Telegram Bot API, for running the bot locally.
+
+    python scripts/fake_bot_api.py --port 8081
+    BOT_API_URL=http://127.0.0.1:8081 BOT_TOKEN=1:fake python -m app.main
+
+Updates are injected with POST /_updates (one update or a list) and handed
+out through getUpdates. Every call made by the bot is counted, see GET /_stats.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+
+# Methods that return a Message
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendVideo", "sendAudio", "sendVoice", "sendAnimation",
+    "sendSticker", "sendLocation", "sendContact", "forwardMessage", "editMessageText", "editMessageCaption",
+}
+
+
+class FakeBotApi:
+    def __init__(self, retry_after_every: int = 0, latency: float = 0.0) -> None:
+        self.retry_after_every = retry_after_every
+        self.latency = latency
+        self.updates: list[dict] = []
+        self.calls: Counter[str] = Counter()
+        self.sends = 0
+        self.started = time.monotonic()
+        self._new_updates = asyncio.Condition()
+        self._message_ids = itertools.count(1)
+        self._thread_ids = itertools.count(100)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/_updates", self.add_updates)
+        app.router.add_get("/_stats", self.stats)
+        app.router.add_route("*", "/file/bot{token}/{path:.*}", self.download)
+        app.router.add_route("*", "/bot{token}/{method}", self.call)
+        return app
+
+    async def add_updates(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        async with self._new_updates:
+            self.updates.extend(payload if isinstance(payload, list) else [payload])
+            self._new_updates.notify_all()
+        return web.json_response({"ok": True, "pending": len(self.updates)})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        elapsed = time.monotonic() - self.started
+        return web.json_response({
+            "calls": dict(self.calls),
+            "sends": self.sends,
+            "sends_per_second": round(self.sends / elapsed, 2) if elapsed else 0,
+            "pending_updates": len(self.updates),
+        })
+
+    async def download(self, request: web.Request) -> web.Response:
+        return web.Response(body=b"fake file")
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+        }
+        if params.get("text"):
+            message["text"] = params["text"]
+        if params.get("message_thread_id"):
+            message["message_thread_id"] = int(params["message_thread_id"])
+        return message
+
+    async def call(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+
+        if method.startswith(("send", "copy", "forward")):
+            self.sends += 1
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.retry_after_every and self.sends % self.retry_after_every == 0:
+                return web.json_response({
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                })
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self._get_updates(params)
+        elif method in MESSAGE_METHODS:
+            result = self._message(params)
+        elif method == "sendMediaGroup":
+            media = json.loads(params.get("media") or "[]")
+            result = [self._message(params) for _ in media]
+        elif method == "copyMessage":
+            result = {"message_id": next(self._message_ids)}
+        elif method == "createForumTopic":
+            result = {"message_thread_id": next(self._thread_ids), "name": params.get("name", ""), "icon_color": 7322096}
+        elif method == "getFile":
+            file_id = params.get("file_id", "")
+            result = {"file_id": file_id, "file_unique_id": file_id, "file_size": 9, "file_path": f"files/{file_id}"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        async with self._new_updates:
+            # Confirmed updates are dropped, as Telegram does
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self._new_updates.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.updates[:100]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--retry-after-every", type=int, default=0, help="answer every N-th send with 429")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds every send takes, like a real round trip")
+    args = parser.parse_args()
+
+    web.run_app(FakeBotApi(args.retry_after_every, args.latency).make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
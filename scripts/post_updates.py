@@ -0,0 +1,70 @@
+"""POST recorded Telegram updates to a locally running webhook server.
+
+    BOT_MODE=webhook python -m app.main
+    python scripts/post_updates.py updates.jsonl --repeat 100
+
+The file is a JSON list of updates, a single update or one update per line.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.webhook import SECRET_HEADER, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET  # noqa: E402
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    if "\n" not in text:
+        return [json.loads(text)]
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+async def post_all(url: str, secret: str, updates: list[dict], repeat: int, concurrency: int) -> None:
+    headers = {SECRET_HEADER: secret} if secret else {}
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses: dict[int, int] = {}
+
+    async def post(session: aiohttp.ClientSession, update: dict) -> None:
+        async with semaphore:
+            async with session.post(url, json=update, headers=headers) as resp:
+                statuses[resp.status] = statuses.get(resp.status, 0) + 1
+
+    started = time.monotonic()
+    async with aiohttp.ClientSession() as session:
+        tasks = []
+        for round_no in range(repeat):
+            for update in updates:
+                # Distinct update ids, as Telegram would send them
+                tasks.append(post(session, {**update, "update_id": update.get("update_id", 0) + round_no * len(updates)}))
+        await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    total = sum(statuses.values())
+    print(f"Отправлено {total} обновлений за {elapsed:.2f} с ({total / elapsed:.0f}/с), ответы: {statuses}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="POST recorded updates to the webhook server")
+    parser.add_argument("path")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=WEBHOOK_SECRET)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    asyncio.run(post_all(args.url, args.secret, load_updates(args.path), args.repeat, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Streaming export/import of bot tables to and from CSV or JSONL.
+
+    python scripts/transfer.py export warranties warranties.jsonl
+    python scripts/transfer.py import warranties warranties.csv --batch-size 10000
+
+Rows are streamed in batches, so memory use does not depend on table size.
+Imports run batched executemany calls, one transaction per batch. Warranties
+whose normalized Честный знак code is already in the database are skipped.
+
+With --offline (the bot must be stopped) the search index and counter
+triggers are dropped for the load and the derived data is rebuilt once at
+the end, which is several times faster for large files.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Any, Iterator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from app.db import CLAIM_COLUMNS, CLAIM_NOTE_COLUMNS, Database, normalize_cz_code  # noqa: E402
+
+TABLES = ("users", "warranties", "claims", "claim_notes")
+
+# Archived rows are exported together with the hot ones
+ARCHIVE_TABLES = {
+    "claims": ("claims_archive", CLAIM_COLUMNS),
+    "claim_notes": ("claim_notes_archive", CLAIM_NOTE_COLUMNS),
+}
+
+
+def detect_format(path: str, fmt: str | None) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+
+
+def export_table(conn: sqlite3.Connection, table: str, path: str, fmt: str, batch_size: int) -> int:
+    # The source may predate the archive tables, it is never migrated by an export
+    if table in ARCHIVE_TABLES and table_exists(conn, ARCHIVE_TABLES[table][0]):
+        archive_table, columns = ARCHIVE_TABLES[table]
+        cur = conn.execute(f"SELECT {columns} FROM {table} UNION ALL SELECT {columns} FROM {archive_table}")
+    else:
+        cur = conn.execute(f"SELECT * FROM {table}")
+    columns = [item[0] for item in cur.description]
+
+    count = 0
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f) if fmt == "csv" else None
+        if writer:
+            writer.writerow(columns)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            for row in rows:
+                if writer:
+                    writer.writerow(["" if value is None else value for value in row])
+                else:
+                    f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False))
+                    f.write("\n")
+            count += len(rows)
+    return count
+
+
+def read_rows(path: str, fmt: str) -> Iterator[dict[str, Any]]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            for row in csv.DictReader(f):
+                # CSV has no NULL, empty cells are imported as NULL
+                yield {key: (value if value != "" else None) for key, value in row.items()}
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def import_table(conn: sqlite3.Connection, table: str, path: str, fmt: str, batch_size: int) -> tuple[int, int]:
+    known_columns = table_columns(conn, table)
+    rows = read_rows(path, fmt)
+    first = next(rows, None)
+    if first is None:
+        return 0, 0
+    columns = [column for column in first if column in known_columns]
+    if table == "claim_notes" and "id" in columns:
+        # Note ids are AUTOINCREMENT and local to a database: with the source ids,
+        # notes colliding with existing ones would be ignored
+        columns.remove("id")
+    if table == "warranties" and "cz_key" not in columns:
+        columns.append("cz_key")
+
+    column_sql = ", ".join(columns)
+    placeholders = ", ".join(["?"] * len(columns))
+    if table == "warranties":
+        # Skip codes that are already registered (including earlier rows of this file)
+        sql = (
+            f"INSERT OR IGNORE INTO warranties ({column_sql}) SELECT {placeholders} "
+            "WHERE NOT EXISTS (SELECT 1 FROM warranties WHERE cz_key = ?)"
+        )
+    else:
+        sql = f"INSERT OR IGNORE INTO {table} ({column_sql}) VALUES ({placeholders})"
+
+    def params(row: dict[str, Any]) -> list[Any]:
+        if table == "warranties":
+            row["cz_key"] = normalize_cz_code(row.get("cz_code") or "") or None
+            return [row.get(column) for column in columns] + [row["cz_key"]]
+        return [row.get(column) for column in columns]
+
+    total = inserted = 0
+    batch = [params(first)]
+    for row in rows:
+        batch.append(params(row))
+        if len(batch) >= batch_size:
+            inserted += flush(conn, sql, batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        inserted += flush(conn, sql, batch)
+        total += len(batch)
+    return total, inserted
+
+
+def flush(conn: sqlite3.Connection, sql: str, batch: list[list[Any]]) -> int:
+    # rowcount, unlike total_changes, does not include rows written by triggers
+    with conn:
+        cur = conn.executemany(sql, batch)
+    return cur.rowcount
+
+
+async def prepare_schema(path: str, rebuild: bool = False) -> None:
+    # Creates missing tables and triggers, fills derived columns (epoch timestamps, cz_key)
+    db = Database(path)
+    await db.init()
+    try:
+        if rebuild:
+            await db.rebuild_search_index()
+            await db.rebuild_stats()
+    finally:
+        await db.close()
+
+
+def drop_insert_triggers(conn: sqlite3.Connection, table: str) -> None:
+    # Database.init() recreates them
+    names = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = ? AND name LIKE '%_insert'",
+        (table,),
+    ).fetchall()
+    with conn:
+        for (name,) in names:
+            conn.execute(f"DROP TRIGGER {name}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export/import bot tables as CSV or JSONL")
+    parser.add_argument("action", choices=("export", "import"))
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "jsonl"), default=None, help="по умолчанию по расширению файла")
+    parser.add_argument("--db", default=os.getenv("DB_PATH", os.path.join(ROOT, "data", "data.db")))
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--offline", action="store_true", help="быстрый импорт при остановленном боте")
+    args = parser.parse_args()
+
+    fmt = detect_format(args.path, args.format)
+    started = time.monotonic()
+
+    if args.action == "export":
+        # Read-only: an export must not migrate or otherwise change the source database
+        conn = sqlite3.connect(f"file:{args.db}?mode=ro", uri=True)
+        try:
+            count = export_table(conn, args.table, args.path, fmt, args.batch_size)
+        finally:
+            conn.close()
+        elapsed = time.monotonic() - started
+        print(f"Экспортировано {count} строк из {args.table} за {elapsed:.1f} с")
+        return
+
+    asyncio.run(prepare_schema(args.db))
+    conn = sqlite3.connect(args.db)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    if args.offline:
+        drop_insert_triggers(conn, args.table)
+    try:
+        total, inserted = import_table(conn, args.table, args.path, fmt, args.batch_size)
+    finally:
+        conn.close()
+        # Fill epoch columns of the imported rows, restore triggers after --offline
+        asyncio.run(prepare_schema(args.db, rebuild=args.offline))
+    elapsed = time.monotonic() - started
+    print(f"Импортировано {inserted} из {total} строк в {args.table} за {elapsed:.1f} с (пропущено: {total - inserted})")
+
+
+if __name__ == "__main__":
+    main()